@@ -2,14 +2,22 @@ from flask import Flask
 from config import Config
 from app.game import bp as game_bp
 from . import db
+from .game import world
+from . import storage
+from . import metrics
 from datetime import timedelta
 
 def create_app(config_class=Config): 
     app = Flask(__name__)
     app.config.from_object(config_class)
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=32)
+    app.logger.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
 
+    # registered before the blueprint so its timer also covers the game's before_request hooks
+    metrics.init_app(app)
     app.register_blueprint(game_bp)
     db.init_app(app)
+    world.init_app(app)
+    storage.init_app(app)
 
     return app
\ No newline at end of file
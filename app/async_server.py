@@ -0,0 +1,238 @@
+import asyncio
+import io
+import re
+import resource
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_to_bytes
+
+# asyncio serving mode, started with `flask serve-async`. the event loop owns the sockets, so an
+# idle player (a keep-alive connection waiting for its next command) costs a coroutine and a
+# couple of small buffers instead of a whole sync worker. the requests themselves still go
+# through the flask app (routes, sessions, parse, metrics are all exactly the same as under
+# gunicorn), just not on the event loop:
+#
+#   - commands and anything else that writes (every method but GET/HEAD/OPTIONS) are queued to a
+#     single writer thread and run one after another. sqlite only has one writer at a time
+#     anyway, so this is the same throughput without workers queuing on the write lock
+#   - page renders and story log reads (/api/log) run on a small pool of reader threads, which
+#     read from their own query_only connections under WAL and never wait behind a slow write
+#
+# the http side is a small HTTP/1.1 implementation (keep-alive, content-length bodies only)
+# meant to sit behind a reverse proxy like nginx, not to face the internet directly.
+
+MAX_HEADER_BYTES = 64 * 1024
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+DIGITS = re.compile(r"[0-9]+")
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+STATUS_TEXT = {
+    400: "400 Bad Request", 411: "411 Length Required", 413: "413 Content Too Large",
+    431: "431 Request Header Fields Too Large", 500: "500 Internal Server Error",
+}
+
+async def read_request(reader, max_body):
+    # (method, target, version, headers, body), or None if the client closed the connection
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HttpError(400)
+    except asyncio.LimitOverrunError:
+        raise HttpError(431)
+
+    lines = head.decode('latin-1').split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HttpError(400)
+    headers = []
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers.append((name.strip().lower(), value.strip()))
+    fields = dict(headers)
+
+    if 'transfer-encoding' in fields:
+        raise HttpError(411)
+    # a length that's repeated with different values, or isn't plain digits, could be read one way
+    # by a proxy in front and another way here (request smuggling), so it's refused outright
+    lengths = {value for name, value in headers if name == 'content-length'}
+    if len(lengths) > 1:
+        raise HttpError(400)
+    length = lengths.pop() if lengths else "0"
+    if not DIGITS.fullmatch(length):
+        raise HttpError(400)
+    length = int(length)
+    if length > max_body:
+        raise HttpError(413)
+    body = await reader.readexactly(length) if length else b""
+    return method, target, version, headers, body
+
+def build_environ(request, peer, server_address):
+    method, target, version, headers, body = request
+    path, _, query = target.partition("?")
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': "",
+        'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': server_address[0],
+        'SERVER_PORT': str(server_address[1]),
+        'SERVER_PROTOCOL': version,
+        'REMOTE_ADDR': peer[0] if peer else "",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers:
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace("-", "_")
+            # repeated headers are joined the way a wsgi server would
+            environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+def call_app(app, environ):
+    # runs on a writer/reader thread. the whole response is collected, the app never streams
+    response = []
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+        return chunks.append
+
+    result = app(environ, start_response)
+    try:
+        for chunk in result:
+            chunks.append(chunk)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response[0], response[1], b"".join(chunks)
+
+def encode_response(status, headers, content, keep_alive):
+    lines = ["HTTP/1.1 " + status]
+    has_length = False
+    for name, value in headers:
+        lines.append(f"{name}: {value}")
+        has_length = has_length or name.lower() == 'content-length'
+    if not has_length:
+        lines.append(f"Content-Length: {len(content)}")
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + content
+
+def wants_keep_alive(version, headers):
+    connection = dict(headers).get('connection', "").lower()
+    if version == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+def raise_open_file_limit():
+    # every idle player is an open socket, so take whatever the hard limit allows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+class AsyncServer:
+    def __init__(self, app, read_threads=4, keepalive_timeout=300, max_body=64 * 1024):
+        self.app = app
+        self.keepalive_timeout = keepalive_timeout
+        self.max_body = max_body
+        self.read_threads = read_threads
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix='writer')
+        self.readers = ThreadPoolExecutor(read_threads, thread_name_prefix='reader')
+        self.server_address = None
+        # connections waiting for their next request, closed straight away on shutdown
+        self.idle = set()
+        self.connections = 0
+
+    async def respond(self, request, peer):
+        environ = build_environ(request, peer, self.server_address)
+        executor = self.readers if request[0] in READ_METHODS else self.writer
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, call_app, self.app, environ)
+        except Exception:
+            self.app.logger.exception("Unhandled error serving %s %s", request[0], request[1])
+            return STATUS_TEXT[500], [('Content-Type', 'text/plain')], b"Internal Server Error"
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        self.connections += 1
+        try:
+            while True:
+                self.idle.add(writer)
+                try:
+                    request = await asyncio.wait_for(read_request(reader, self.max_body), self.keepalive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except HttpError as e:
+                    writer.write(encode_response(STATUS_TEXT[e.status], [('Content-Type', 'text/plain')], b"", False))
+                    await writer.drain()
+                    break
+                finally:
+                    self.idle.discard(writer)
+                if request is None:
+                    break
+
+                status, headers, content = await self.respond(request, peer)
+                keep_alive = wants_keep_alive(request[2], request[3])
+                writer.write(encode_response(status, headers, content, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            self.idle.discard(writer)
+            writer.close()
+
+    async def serve(self, host, port, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES, backlog=1024)
+        self.server_address = server.sockets[0].getsockname()[:2]
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+        self.app.logger.info("Serving on http://%s:%s (async, %d reader threads)", self.server_address[0], self.server_address[1], self.read_threads)
+        if ready is not None:
+            ready(self)
+        async with server:
+            await stopping.wait()
+            server.close()
+            for writer in list(self.idle):
+                writer.close()
+        # let queued commands finish before exiting
+        await loop.run_in_executor(None, self.writer.shutdown)
+        await loop.run_in_executor(None, self.readers.shutdown)
+        self.app.logger.info("Stopped")
+
+def run_server(app, host, port):
+    config = app.config
+    limit = raise_open_file_limit()
+    app.logger.info("Open file limit %d", limit)
+    server = AsyncServer(
+        app,
+        read_threads=config.get('ASYNC_READ_THREADS', 4),
+        keepalive_timeout=config.get('ASYNC_KEEPALIVE_TIMEOUT', 300),
+        max_body=config.get('ASYNC_MAX_BODY', 64 * 1024),
+    )
+    asyncio.run(server.serve(host, port))
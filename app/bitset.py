@@ -0,0 +1,55 @@
+# a set of small non-negative ints (item, story flag and location ids) packed one bit per id into
+# a bytearray, for player progress stored as blobs on the players row (see app/game/state.py).
+# membership and add are O(1) no matter how big the ids get, and the blob is what's stored, with
+# trailing zero bytes dropped so it stays as short as the highest id in it.
+
+class Bitset:
+    __slots__ = ('bits',)
+
+    def __init__(self, data=None):
+        self.bits = bytearray(data or b'')
+
+    @classmethod
+    def of(cls, ids):
+        bitset = cls()
+        for i in ids:
+            bitset.add(i)
+        return bitset
+
+    def __contains__(self, i):
+        index = i >> 3
+        return 0 <= index < len(self.bits) and bool(self.bits[index] & (1 << (i & 7)))
+
+    def add(self, i):
+        if i < 0:
+            raise ValueError(f"bitset ids can't be negative: {i}")
+        index = i >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+        self.bits[index] |= 1 << (i & 7)
+
+    def __iter__(self):
+        # ascending, like sorted()
+        for index, byte in enumerate(self.bits):
+            while byte:
+                low = byte & -byte
+                yield index * 8 + low.bit_length() - 1
+                byte ^= low
+
+    def __len__(self):
+        return sum(byte.bit_count() for byte in self.bits)
+
+    def __bool__(self):
+        return any(self.bits)
+
+    def __eq__(self, other):
+        return isinstance(other, Bitset) and self.to_bytes() == other.to_bytes()
+
+    def copy(self):
+        return Bitset(self.bits)
+
+    def to_bytes(self):
+        return bytes(self.bits.rstrip(b'\0'))
+
+    def __repr__(self):
+        return f"Bitset({list(self)})"
@@ -0,0 +1,73 @@
+import threading
+
+from flask import render_template
+from markupsafe import Markup
+
+from .text import build_string_of_list_w_commas
+
+# pieces of output that only depend on which room the player is in: the side panel (as html for
+# index and as json for /api/command) and the "You find yourself in..." arrival text. they're built
+# once per (world version, location) in each worker and reused after that.
+#
+# the world never changes while it's loaded, and load_world clears the cache whenever a world is
+# (re)loaded, e.g. after the snapshot is rebuilt (see get_world), so nothing here has to be
+# invalidated by hand.
+
+class FragmentCache:
+    def __init__(self, max_entries=10000):
+        self.entries = {}
+        self.max_entries = max_entries
+        # serve-async reader threads and threaded workers share the cache. a hit is a plain dict
+        # lookup, the lock is only taken to evict and insert (building happens outside it)
+        self.lock = threading.Lock()
+
+    def get(self, world, kind, location_id, build):
+        key = (world.version, kind, location_id)
+        fragment = self.entries.get(key)
+        if fragment is None:
+            fragment = build(world, location_id)
+            with self.lock:
+                if key not in self.entries and len(self.entries) >= self.max_entries:
+                    # dicts keep insertion order, so this drops the oldest fragment
+                    self.entries.pop(next(iter(self.entries)), None)
+                fragment = self.entries.setdefault(key, fragment)
+        return fragment
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+fragments = FragmentCache()
+
+def build_arrival_entries(world, location_id):
+    location = world.locations[location_id]
+    object_names = [obj.name for obj in world.objects_in(location_id)]
+    return (
+        ("You find yourself in " + location.description, ""),
+        ("Available objects are: " + build_string_of_list_w_commas(object_names), "Hint"),
+    )
+
+def build_room_panel(world, location_id):
+    location = world.locations[location_id]
+    return Markup(render_template('_room_panel.html', location=location, objects=world.objects_in(location_id)))
+
+def build_room_dict(world, location_id):
+    location = world.locations.get(location_id)
+    return {
+        'location': {
+            'id': location_id,
+            'name': location.location_name if location else "",
+            'description': location.description if location else "",
+        },
+        'objects': [obj.name for obj in world.objects_in(location_id)],
+    }
+
+def arrival_entries(world, location_id):
+    return fragments.get(world, 'arrival', location_id, build_arrival_entries)
+
+def room_panel(world, location_id):
+    return fragments.get(world, 'panel', location_id, build_room_panel)
+
+def room_dict(world, location_id):
+    # callers add their own keys to the response, so they get a copy
+    return dict(fragments.get(world, 'panel json', location_id, build_room_dict))
@@ -0,0 +1,58 @@
+# what the player types, turned into commands. a line can hold several commands separated by ';'
+# ("open crates; inspect door"), which process runs one after another in the same turn. each
+# command is a verb, then the object, then optionally a preposition and a second phrase:
+#
+#   inspect crates
+#   open door with key
+#
+# the verbs are the system ones below plus every action in object_interactions, so new content
+# can bring new verbs without touching the code. each world builds its Grammar once
+# (WorldModel.grammar()), and parse in utils.py dispatches on the verb it gives back.
+
+SYSTEM_VERBS = ('clear', 'help', 'inventory', 'travel')
+# these only ever stand on their own
+ONE_WORD_VERBS = ('clear', 'help', 'inventory')
+# and these work on their own too: inspect without an object looks around the room
+BARE_VERBS = ONE_WORD_VERBS + ('inspect',)
+ALIASES = {'look': 'inspect', 'examine': 'inspect', 'x': 'inspect', 'l': 'inspect', 'i': 'inventory'}
+PREPOSITIONS = ('with', 'on', 'in')
+COMMAND_SEPARATOR = ';'
+
+def split_commands(text):
+    # one list of lowercase words per command. an empty line is still one (empty) command, so the
+    # player hears about it, but empty commands between separators are dropped
+    commands = [part.lower().split() for part in text.split(COMMAND_SEPARATOR)]
+    commands = [words for words in commands if words]
+    return commands or [[]]
+
+class Grammar:
+    def __init__(self, actions):
+        # verbs that act on an object, in the order the content first uses them
+        self.object_verbs = tuple(dict.fromkeys(actions))
+        self.verbs = {verb: verb for verb in self.object_verbs + SYSTEM_VERBS}
+        for alias, verb in ALIASES.items():
+            if verb in self.verbs:
+                self.verbs.setdefault(alias, verb)
+
+    def verb(self, word):
+        return self.verbs.get(word)
+
+    def listed_verbs(self):
+        # what help and the invalid command warning list, clear/help/inventory have their own mention
+        return [verb for verb in self.object_verbs + SYSTEM_VERBS if verb not in ONE_WORD_VERBS]
+
+    def one_word_commands(self):
+        # every word (verb or alias) that is a whole command by itself, for the warning when a
+        # single word isn't
+        return [word for word, verb in self.verbs.items() if verb in BARE_VERBS]
+
+    def split_target(self, words, resolves):
+        # (object words, preposition, second phrase words). the whole phrase is the object if it
+        # names one, since names have prepositions in them too ("first door on the left"),
+        # otherwise it's split at the first preposition that leaves an object on its left
+        if resolves(words):
+            return words, None, []
+        for i, word in enumerate(words):
+            if i > 0 and word in PREPOSITIONS and resolves(words[:i]):
+                return words[:i], word, words[i + 1:]
+        return words, None, []
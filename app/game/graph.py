@@ -0,0 +1,249 @@
+from collections import deque
+
+from .rules import has_flag, has_item
+
+# the rooms and the links between them as a graph, built from location_links and
+# object_interactions once per world (see WorldModel.graph). an edge is an interaction that moves
+# the player, gated by whatever item and story flag it requires. keys (items and story flags) are
+# handed out by interactions too, which can be gated themselves. gates and keys are the same
+# (state attribute, id) conditions the compiled rules check (see rules.py), so a player's state
+# can be tested against them directly.
+#
+# keys are never taken away, so everything a player can reach only ever grows and each query is
+# a single O(V + E) pass:
+#
+#   reachable(start)         -> rooms and keys a player can get to from start, collecting every key
+#   path(start, goal, can)   -> fewest links from start to goal through gates can(requires) opens
+#   report(start)            -> unreachable rooms, dead ends, gates that never open and soft-locks
+#                               (plus, for soft-locks, a pass per key that can be missed, see soft_locks)
+
+class Edge:
+    __slots__ = ('from_location_id', 'to_location_id', 'requires', 'object_id', 'action', 'location_link_id')
+
+    def __init__(self, from_location_id, to_location_id, requires, object_id, action, location_link_id):
+        self.from_location_id = from_location_id
+        self.to_location_id = to_location_id
+        self.requires = requires
+        self.object_id = object_id
+        self.action = action
+        self.location_link_id = location_link_id
+
+class KeySource:
+    # an interaction that gives an item or activates a story flag
+    __slots__ = ('location_id', 'key', 'requires', 'object_id', 'action')
+
+    def __init__(self, location_id, key, requires, object_id, action):
+        self.location_id = location_id
+        self.key = key
+        self.requires = requires
+        self.object_id = object_id
+        self.action = action
+
+def describe_key(world, key):
+    attribute, key_id = key
+    if attribute == 'inventory':
+        item = world.items.get(key_id)
+        return f"item '{item.item_name if item else key_id}'"
+    story_flag = world.story_flags.get(key_id)
+    return f"story flag '{story_flag.flag_name if story_flag else key_id}'"
+
+def interaction_requires(interaction):
+    requires = []
+    if interaction.requires_item_id is not None:
+        requires.append(has_item(interaction.requires_item_id))
+    if interaction.requires_story_flag_id is not None:
+        requires.append(has_flag(interaction.requires_story_flag_id))
+    return tuple(requires)
+
+class WorldGraph:
+    def __init__(self, world):
+        self.world = world
+        self.edges = {}
+        self.reverse = {}
+        self.sources = {}
+        for interaction in world.interactions.values():
+            obj = world.objects.get(interaction.object_id)
+            if obj is None:
+                continue
+            requires = interaction_requires(interaction)
+            if interaction.location_link_id is not None:
+                link = world.location_links[interaction.location_link_id]
+                # the player uses the link from wherever the object is
+                edge = Edge(obj.location_id, link.to_location_id, requires, obj.object_id, interaction.action, link.location_link_id)
+                self.edges.setdefault(edge.from_location_id, []).append(edge)
+                self.reverse.setdefault(edge.to_location_id, []).append(edge)
+            if interaction.gives_item_id is not None:
+                self.add_source(KeySource(obj.location_id, has_item(interaction.gives_item_id), requires, obj.object_id, interaction.action))
+            if interaction.activates_story_flag_id is not None:
+                self.add_source(KeySource(obj.location_id, has_flag(interaction.activates_story_flag_id), requires, obj.object_id, interaction.action))
+        self.edge_count = sum(len(edges) for edges in self.edges.values())
+
+    def add_source(self, source):
+        self.sources.setdefault(source.location_id, []).append(source)
+
+    def reachable(self, start, keys=(), banned=frozenset(), until=None):
+        # (rooms, keys) a player starting in start with keys can get to, never picking up banned keys
+        # (and stopping as soon as they have the key until, when that's given).
+        # anything whose gate isn't open yet waits on the first key it's missing and is looked at
+        # again when that key turns up, so every edge and source is handled at most once per key
+        # it requires
+        keys = set(keys)
+        rooms = {start}
+        queue = deque([start])
+        waiting = {}
+        gained = deque()
+
+        def consider(thing):
+            for key in thing.requires:
+                if key not in keys:
+                    waiting.setdefault(key, []).append(thing)
+                    return
+            if isinstance(thing, Edge):
+                if thing.to_location_id not in rooms:
+                    rooms.add(thing.to_location_id)
+                    queue.append(thing.to_location_id)
+            elif thing.key not in keys and thing.key not in banned:
+                keys.add(thing.key)
+                gained.append(thing.key)
+
+        while (queue or gained) and (until is None or until not in keys):
+            if gained:
+                for thing in waiting.pop(gained.popleft(), ()):
+                    consider(thing)
+                continue
+            room = queue.popleft()
+            for source in self.sources.get(room, ()):
+                consider(source)
+            for edge in self.edges.get(room, ()):
+                consider(edge)
+        return rooms, keys
+
+    def path(self, start, goal, can_open, can_enter=None):
+        # fewest links from start to goal, as a list of edges (None if there's no way), only through
+        # gates can_open(requires) is true for and rooms can_enter(location_id) is true for
+        if start == goal:
+            return []
+        came_from = {start: None}
+        queue = deque([start])
+        while queue:
+            room = queue.popleft()
+            for edge in self.edges.get(room, ()):
+                to = edge.to_location_id
+                if to in came_from or (can_enter is not None and not can_enter(to)):
+                    continue
+                if edge.requires and not can_open(edge.requires):
+                    continue
+                came_from[to] = edge
+                if to == goal:
+                    path = []
+                    while edge is not None:
+                        path.append(edge)
+                        edge = came_from[edge.from_location_id]
+                    path.reverse()
+                    return path
+                queue.append(to)
+        return None
+
+    def components(self, opens):
+        # strongly connected components of the edges opens(edge) is true for (kosaraju, iterative so
+        # a long corridor of a world doesn't hit the recursion limit). location_id -> component
+        order = []
+        seen = set()
+        for root in self.world.locations:
+            if root in seen:
+                continue
+            seen.add(root)
+            stack = [(root, iter(self.edges.get(root, ())))]
+            while stack:
+                room, edges = stack[-1]
+                for edge in edges:
+                    if opens(edge) and edge.to_location_id not in seen:
+                        seen.add(edge.to_location_id)
+                        stack.append((edge.to_location_id, iter(self.edges.get(edge.to_location_id, ()))))
+                        break
+                else:
+                    stack.pop()
+                    order.append(room)
+        # each component is known by its first room in the second pass
+        component = {}
+        for root in reversed(order):
+            if root in component:
+                continue
+            component[root] = root
+            stack = [root]
+            while stack:
+                for edge in self.reverse.get(stack.pop(), ()):
+                    if opens(edge) and edge.from_location_id not in component:
+                        component[edge.from_location_id] = root
+                        stack.append(edge.from_location_id)
+        return component
+
+    def soft_locks(self, start, reachable_rooms, keys):
+        # a soft-lock is a link a player can take without some key that they then can't get any
+        # more, and that a gate or interaction they're left with needs. gives (edge, key) pairs.
+        # for each key: the rooms and keys a player can have without it, then the links out of those
+        # rooms that open without it and lead out of their strongly connected component (of links
+        # that open without it, links inside one can always be walked back). past such a link the
+        # player is checked with every other key they could have had, so whatever is reported locks
+        # even a player who collected everything else. a full pass per key and target component,
+        # for the keys that get past the quick check below
+        needed_in = {}
+        for things in list(self.edges.values()) + list(self.sources.values()):
+            for thing in things:
+                for key in thing.requires:
+                    needed_in.setdefault(key, set()).add(thing.from_location_id if isinstance(thing, Edge) else thing.location_id)
+
+        locks = []
+        for key in sorted(keys):
+            # the quick way out, and the usual case: if a player holding nothing can get the key from
+            # every room that needs it, nobody can be stuck without it
+            if all(key in self.reachable(room, until=key)[1] for room in sorted(needed_in.get(key, ()))):
+                continue
+            rooms_without, keys_without = self.reachable(start, banned=frozenset([key]))
+
+            def opens(edge):
+                return all(k in keys_without for k in edge.requires)
+
+            component = self.components(opens)
+            stuck = {}
+            for room in sorted(rooms_without & reachable_rooms):
+                for edge in self.edges.get(room, ()):
+                    entry = edge.to_location_id
+                    if not opens(edge) or component.get(room) == component.get(entry):
+                        continue
+                    group = component.get(entry)
+                    if group not in stuck:
+                        stuck[group] = self.stuck_without(entry, key, keys_without)
+                    if stuck[group]:
+                        locks.append((edge, key))
+        return locks
+
+    def stuck_without(self, room, key, keys_without):
+        # whether a player in room with keys_without can never get key, while something they can
+        # still get to needs it (and nothing else they're missing)
+        rooms, held = self.reachable(room, keys_without)
+        if key in held:
+            return False
+        for r in rooms:
+            for thing in self.edges.get(r, []) + self.sources.get(r, []):
+                if key in thing.requires and all(k == key or k in held for k in thing.requires):
+                    return True
+        return False
+
+    def report(self, start):
+        rooms, keys = self.reachable(start)
+        unreachable = sorted(set(self.world.locations) - rooms)
+        dead_ends = sorted(location_id for location_id in self.world.locations if not self.edges.get(location_id))
+        shut_gates = [
+            (edge, tuple(key for key in edge.requires if key not in keys))
+            for room in sorted(rooms) for edge in self.edges.get(room, ())
+            if any(key not in keys for key in edge.requires)
+        ]
+        return {
+            'reachable': rooms,
+            'keys': keys,
+            'unreachable': unreachable,
+            'dead_ends': dead_ends,
+            'shut_gates': shut_gates,
+            'soft_locks': self.soft_locks(start, rooms, keys),
+        }
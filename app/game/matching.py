@@ -0,0 +1,152 @@
+import re
+
+# fuzzy object matching, for when what the player typed isn't exactly an object's name or one of
+# its synonyms (WorldModel.resolve tries that first). both sides are cut down to tokens: lowercase,
+# punctuation and parentheses gone, stopwords dropped and ordinals spelled out, so "the 1st door on
+# the left" and "first door left" are the same thing. then every typed token has to match a
+# different token of an object's name or synonym, in any order, either
+#
+#   exactly              cost 0
+#   as a prefix          cost 1   ("emerg" -> "emergency", at least MIN_PREFIX letters)
+#   with a typo or two   cost 2 per edit ("wardorbe" -> "wardrobe"), see max_edits
+#
+# plus 1 for every token of the name the player left out. the cheapest phrase wins, and if two
+# different objects tie nothing matches, so "door" in a hallway of doors still asks which one.
+#
+# each room gets a RoomMatcher with a trie over the tokens in that room, built the first time the
+# room needs one and cached with the other per-room fragments (see fragments.py). typo lookups walk
+# the trie keeping one edit distance row per node and stop going down a branch as soon as every
+# entry in the row is over the limit, so the cost stays bounded by the room's vocabulary.
+
+STOPWORDS = frozenset(['the', 'a', 'an', 'at', 'to', 'towards', 'toward', 'of', 'on'])
+TOKEN_ALIASES = {'1st': 'first', '2nd': 'second', '3rd': 'third', '4th': 'fourth', '5th': 'fifth'}
+MIN_PREFIX = 3
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+END = None
+
+def canonical_tokens(phrase):
+    words = [TOKEN_ALIASES.get(word, word) for word in WORD_PATTERN.findall(phrase.lower())]
+    tokens = tuple(word for word in words if word not in STOPWORDS)
+    # a phrase made only of stopwords is still something to match
+    return tokens or tuple(words)
+
+def max_edits(token):
+    if len(token) >= 8:
+        return 2
+    if len(token) >= 4:
+        return 1
+    return 0
+
+class TokenTrie:
+    def __init__(self, tokens):
+        self.root = {}
+        for token in tokens:
+            node = self.root
+            for letter in token:
+                node = node.setdefault(letter, {})
+            node[END] = token
+
+    def with_prefix(self, prefix):
+        node = self.root
+        for letter in prefix:
+            node = node.get(letter)
+            if node is None:
+                return []
+        tokens = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for letter, child in node.items():
+                if letter is END:
+                    tokens.append(child)
+                else:
+                    stack.append(child)
+        return tokens
+
+    def within(self, word, limit):
+        # token -> edit distance for every token at most limit edits away from word
+        found = {}
+        first_row = list(range(len(word) + 1))
+        stack = [(child, letter, first_row) for letter, child in self.root.items() if letter is not END]
+        while stack:
+            node, letter, previous = stack.pop()
+            row = [previous[0] + 1]
+            for i in range(1, len(word) + 1):
+                row.append(min(row[i - 1] + 1, previous[i] + 1, previous[i - 1] + (word[i - 1] != letter)))
+            if END in node and row[-1] <= limit:
+                found[node[END]] = row[-1]
+            if min(row) <= limit:
+                stack.extend((child, next_letter, row) for next_letter, child in node.items() if next_letter is not END)
+        return found
+
+class RoomMatcher:
+    def __init__(self, objects, synonyms_by_object):
+        # (tokens, object_id) for every name and synonym in the room
+        self.phrases = []
+        self.phrases_by_token = {}
+        for obj in objects:
+            for phrase in (obj.name,) + tuple(synonyms_by_object.get(obj.object_id, ())):
+                tokens = canonical_tokens(phrase)
+                if not tokens:
+                    continue
+                index = len(self.phrases)
+                self.phrases.append((tokens, obj.object_id))
+                for token in set(tokens):
+                    self.phrases_by_token.setdefault(token, []).append(index)
+        self.trie = TokenTrie(self.phrases_by_token)
+
+    def token_matches(self, word):
+        # room token -> cost of reading word as it
+        matches = {}
+        if word in self.phrases_by_token:
+            matches[word] = 0
+        if len(word) >= MIN_PREFIX:
+            for token in self.trie.with_prefix(word):
+                matches.setdefault(token, 1)
+        limit = max_edits(word)
+        if limit:
+            for token, edits in self.trie.within(word, limit).items():
+                if 2 * edits < matches.get(token, 2 * edits + 1):
+                    matches[token] = 2 * edits
+        return matches
+
+    def phrase_cost(self, tokens, word_matches):
+        unused = list(tokens)
+        cost = 0
+        for matches in word_matches:
+            best = None
+            for i, token in enumerate(unused):
+                token_cost = matches.get(token)
+                if token_cost is not None and (best is None or token_cost < best[1]):
+                    best = (i, token_cost)
+            if best is None:
+                return None
+            del unused[best[0]]
+            cost += best[1]
+        return cost + len(unused)
+
+    def match(self, phrase):
+        words = canonical_tokens(phrase)
+        if not words:
+            return None
+        word_matches = [self.token_matches(word) for word in words]
+        # only phrases sharing a token with the first word can match every word
+        candidates = {index for token in word_matches[0] for index in self.phrases_by_token[token]}
+        best_cost = None
+        best_objects = set()
+        for index in candidates:
+            tokens, object_id = self.phrases[index]
+            cost = self.phrase_cost(tokens, word_matches)
+            if cost is None:
+                continue
+            if best_cost is None or cost < best_cost:
+                best_cost = cost
+                best_objects = {object_id}
+            elif cost == best_cost:
+                best_objects.add(object_id)
+        if len(best_objects) != 1:
+            return None
+        return best_objects.pop()
+
+def build_room_matcher(world, location_id):
+    return RoomMatcher(world.objects_in(location_id), world.synonyms_by_object)
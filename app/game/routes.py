@@ -1,82 +1,137 @@
-from flask import render_template, session, redirect, request, url_for
+from flask import current_app, render_template, session, redirect, request, url_for, jsonify
 from app.game import bp
-from app.db import get_db
-from .utils import initialize_new_player, process
+from app.storage import get_store
+from .utils import STARTING_LOCATION_ID, get_intro_story, get_or_create_player, process
+from .world import get_world
+from .fragments import room_dict, room_panel
+from .state import get_player_state
+from .story_log import get_latest_entries, get_entries_before, get_entries_after
+import time
 import uuid
 
+# static files and metrics scrapes are not players, they get no session (and no cookie)
+SESSIONLESS_ENDPOINTS = ('static', 'metrics')
+
+def is_sessionless(): 
+    return bool(request.endpoint) and request.endpoint.startswith(SESSIONLESS_ENDPOINTS)
+
 @bp.before_app_request
 def make_session_permanent(): 
+    if is_sessionless(): 
+        return
     session.permanent = True
 
 @bp.before_app_request
 def check_player_id_exists():
-    if request.endpoint and request.endpoint.startswith('static'):
+    if is_sessionless(): 
         return
 
     if 'session_uuid' not in session: 
         session['session_uuid'] = str(uuid.uuid4())
 
     player_id = session.get('player_id')
-    db = get_db()
-
-    if not player_id:
-        cur = db.execute('INSERT INTO players (current_location_id) VALUES (?)', (0, ))
-        db.commit()
-        session['player_id'] = cur.lastrowid
-        print(f"Created new player with id {cur.lastrowid}")
-        initialize_new_player(db, session.get('player_id'))
-    else:
-        cur = db.execute('SELECT * FROM players WHERE player_id = ?', (player_id,))
-        player = cur.fetchone()
-
-        if player is None:
+
+    # new visitors (including crawlers and health checks) don't get a players row until they
+    # send their first command, see get_or_create_player
+    if player_id:
+        # loads the player state once for the whole request
+        store = get_store()
+        state = get_player_state(store, player_id)
+
+        if state is None:
             session.clear()
             session['session_uuid'] = str(uuid.uuid4())
-            print(f"No player found with id {player_id}. Resetting session player_id.")
+            current_app.logger.info("No player found with id %s, resetting the session", player_id)
         else:
-            if player['current_location_id'] is None:
-                db.execute('UPDATE players SET current_location_id = ? WHERE player_id = ?', (0, player_id))
-                db.commit()
-                print(f"Assigned default location (0) to player {player_id}")
+            if state.location_id is None:
+                with store.transaction() as tx:
+                    state.move_to(STARTING_LOCATION_ID)
+                    state.save(tx, int(time.time()))
+                current_app.logger.info("Assigned default location (%s) to player %s", STARTING_LOCATION_ID, player_id)
 
 @bp.route('/')
 def index(): 
-    db = get_db()
+    store = get_store()
     player_id = session.get('player_id')
 
-    objects = []
-    story_log = [""]
-    location = ""
+    has_older = False
+    oldest_cursor = newest_cursor = 0
 
     if player_id: 
-        cur = db.execute("SELECT entry, category FROM story_log WHERE player_id = ? ORDER BY timestamp ASC", (player_id,))
-        story_log = cur.fetchall()
-
-        cur = db.execute('SELECT * FROM players WHERE player_id = ?', (player_id,))
-        player = cur.fetchone()
-        location_id = player['current_location_id']
-        print("Looking for location id: " + str(location_id))
-        cur = db.execute('SELECT * FROM locations WHERE location_id = ?', (location_id,))
-        location = cur.fetchone()
-        print(f"Location query result: {dict(location) if location else 'None'}")
-
-        # checking all locations in the location database to debug location id 0 not found
-        cur = db.execute('SELECT location_id, location_name FROM locations ORDER BY location_id')
-        all_locations = cur.fetchall()
-        print(f"All locations in database: {[(loc['location_id'], loc['location_name']) for loc in all_locations]}")
-
-        cur = db.execute("SELECT * FROM objects WHERE location_id = ?", (location_id, )).fetchall()
-        objects = cur
-    
+        # only the most recent page is rendered, older history is fetched from /api/log on demand
+        story_log, has_older = get_latest_entries(store, player_id)
+        if story_log: 
+            oldest_cursor = story_log[0]['id']
+            newest_cursor = story_log[-1]['id']
+
+        location_id = get_player_state(store, player_id).location_id
+    else: 
+        # players who haven't sent a command yet just see the intro, nothing is in the database
+        story_log = get_intro_story()
+        location_id = STARTING_LOCATION_ID
+
+    world = get_world()
+
+    # the side panel only depends on the room, so it's rendered once per room (see fragments.py)
     error = False
-    if not player_id: 
+    panel = None
+    if location_id in world.locations: 
+        panel = room_panel(world, location_id)
+    else: 
         error = True
-    return render_template('index.html', story_log=story_log, location=location, objects=objects, error=error)
+        current_app.logger.warning("Location %s not found in world %s (%d locations)", location_id, world.version, len(world.locations))
+    return render_template('index.html', story_log=story_log, room_panel=panel, error=error, 
+                           has_older=has_older, oldest_cursor=oldest_cursor, newest_cursor=newest_cursor)
+
+@bp.route('/api/log')
+def story_log_page(): 
+    player_id = session.get('player_id')
+    if not player_id: 
+        return jsonify(error="No player for this session"), 404
+
+    store = get_store()
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None: 
+        limit = max(1, min(limit, 500))
+
+    # ?before=<id> pages backwards through older history, ?after=<id> returns whatever was
+    # appended since the client's newest entry
+    if before is not None: 
+        entries, has_more = get_entries_before(store, player_id, before, limit)
+    elif after is not None: 
+        entries, has_more = get_entries_after(store, player_id, after, limit)
+    else: 
+        entries, has_more = get_latest_entries(store, player_id, limit)
+
+    return jsonify(entries=entries, has_more=has_more)
+
+@bp.route('/api/command', methods=['POST'])
+def api_command(): 
+    # checked before a player row can be created for the request
+    data = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(data, dict): 
+        return jsonify(error="expected a json object with a 'command' string"), 400
+    text = data.get('command', data.get('user_input', ''))
+    if not isinstance(text, str): 
+        return jsonify(error="'command' must be a string"), 400
+    store = get_store()
+    player_id = get_or_create_player(store)
+    entries, cleared = process(text, store, player_id)
+
+    # one round trip per turn: the new log entries plus whatever the side panel needs
+    location_id = get_player_state(store, player_id).location_id
+    response = room_dict(get_world(), location_id)
+    response['entries'] = entries
+    # 'clear' wipes the log, so the client has to drop what it is showing too
+    response['cleared'] = cleared
+    return jsonify(response)
 
 @bp.route('/', methods=['POST'])
 def user_input(): 
     text = request.form['user_input']
-    db = get_db()
-    player_id = session.get('player_id')
-    process(text, db, player_id)
+    store = get_store()
+    player_id = get_or_create_player(store)
+    process(text, store, player_id)
     return redirect('/')
\ No newline at end of file
@@ -0,0 +1,121 @@
+from .fragments import arrival_entries
+
+# every object_interactions row is compiled once (when the world loads) into a Rule: a few
+# condition ops checked against the player's state sets, and a list of effect ops applied in order.
+# all the text a rule can produce is built here too, so running a rule is just set lookups and
+# list appends. new effect types only need an apply_* function and a line in compile_rule.
+#
+# evaluation order:
+#   1. requirements (item, story flag) -> requirements_not_fulfilled_text if any fails
+#   2. already done (gives an item the player has / activates a flag they have) -> already_done_text
+#   3. effects, in order: item usage text, travel, result text, give item, activate flag
+
+class Rule:
+    __slots__ = ('interaction_id', 'requirements', 'failure_text', 'done_checks', 'done_text', 'effects')
+
+    def __init__(self, interaction_id, requirements, failure_text, done_checks, done_text, effects):
+        self.interaction_id = interaction_id
+        self.requirements = requirements
+        self.failure_text = failure_text
+        self.done_checks = done_checks
+        self.done_text = done_text
+        self.effects = effects
+
+# conditions are (state attribute, id) pairs, tested with `id in getattr(state, attribute)`
+
+def has_item(item_id):
+    return ('inventory', item_id)
+
+def has_flag(story_flag_id):
+    return ('story_flags', story_flag_id)
+
+def holds(state, condition):
+    attribute, value = condition
+    return value in getattr(state, attribute)
+
+# effects are (apply function, argument) pairs
+
+def apply_say(state, response, entries):
+    response.extend(entries)
+
+def apply_move(state, response, move):
+    location_id, entries = move
+    state.move_to(location_id)
+    response.extend(entries)
+
+def apply_give_item(state, response, give):
+    item_id, entries = give
+    if item_id not in state.inventory:
+        state.grant_item(item_id)
+        response.extend(entries)
+
+def apply_activate_flag(state, response, activate):
+    story_flag_id, entries = activate
+    if story_flag_id not in state.story_flags:
+        state.activate_flag(story_flag_id)
+        response.extend(entries)
+
+def compile_rule(world, interaction):
+    requirements = []
+    if interaction.requires_item_id is not None:
+        requirements.append(has_item(interaction.requires_item_id))
+    if interaction.requires_story_flag_id is not None:
+        requirements.append(has_flag(interaction.requires_story_flag_id))
+
+    done_checks = []
+    if interaction.gives_item_id is not None:
+        done_checks.append(has_item(interaction.gives_item_id))
+    if interaction.activates_story_flag_id is not None:
+        done_checks.append(has_flag(interaction.activates_story_flag_id))
+
+    effects = []
+    if interaction.requires_item_id is not None and interaction.item_requirement_usage_description:
+        effects.append((apply_say, ((interaction.item_requirement_usage_description, ""),)))
+    if interaction.location_link_id is not None:
+        link = world.location_links[interaction.location_link_id]
+        entries = ((link.travel_description, ""),) + arrival_entries(world, link.to_location_id)
+        effects.append((apply_move, (link.to_location_id, entries)))
+    if interaction.result:
+        effects.append((apply_say, ((interaction.result, ""),)))
+    if interaction.gives_item_id is not None:
+        item = world.items[interaction.gives_item_id]
+        entries = (("+1: " + item.item_name, "Info"), ("Type 'inventory' to view full inventory. ", "Hint"))
+        effects.append((apply_give_item, (item.item_id, entries)))
+    if interaction.activates_story_flag_id is not None:
+        story_flag = world.story_flags[interaction.activates_story_flag_id]
+        entries = (("STORY FLAG ACTIVATED: " + story_flag.flag_name, "Info"),)
+        effects.append((apply_activate_flag, (story_flag.story_flag_id, entries)))
+
+    return Rule(interaction.interaction_id, tuple(requirements), interaction.requirements_not_fulfilled_text,
+                tuple(done_checks), interaction.already_done_text, tuple(effects))
+
+def rule_texts(rule):
+    # every text a rule can put in the story log, except the default failure message
+    if rule.failure_text:
+        yield rule.failure_text
+    if rule.done_text:
+        yield rule.done_text
+    for apply, argument in rule.effects:
+        entries = argument if apply is apply_say else argument[1]
+        for text, _ in entries:
+            yield text
+
+def compile_rules(world):
+    return {key: compile_rule(world, interaction) for key, interaction in world.interactions.items()}
+
+def run_rule(rule, state, command, target_object):
+    for condition in rule.requirements:
+        if not holds(state, condition):
+            if rule.failure_text:
+                return [(rule.failure_text, "")]
+            return [("You are unable to " + command + " the " + target_object + " yet. ", "Warning")]
+
+    # one-shot interactions (the crate with the key, the switches...) that have already happened
+    if rule.done_text and any(holds(state, condition) for condition in rule.done_checks):
+        return [(rule.done_text, "")]
+
+    # the empty entry spaces this turn out from the previous one in the story log
+    response = [("", "")]
+    for apply, argument in rule.effects:
+        apply(state, response, argument)
+    return response
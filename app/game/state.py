@@ -0,0 +1,82 @@
+from flask import g
+
+from app.bitset import Bitset
+
+# everything about a player that parse needs (location, inventory, story flags, visited rooms)
+# lives in one PlayerState, loaded from a single players row once per request. inventory, story
+# flags and visited locations are bitsets (app/bitset.py) stored as blobs on that row, so checking
+# them is O(1) and saving a turn is a single UPDATE of the row.
+#
+# players.state_version is bumped on every save, and save() only writes if the version is still
+# the one it loaded (otherwise StalePlayerState), so two workers playing the same player can't
+# overwrite each other's progress.
+
+class StalePlayerState(Exception):
+    # another worker saved this player after we loaded it
+    pass
+
+class PlayerState:
+    __slots__ = ('player_id', 'location_id', 'inventory', 'story_flags', 'visited', 'version', 'dirty')
+
+    def __init__(self, player_id, location_id, inventory, story_flags, visited, version):
+        self.player_id = player_id
+        self.location_id = location_id
+        self.inventory = inventory
+        self.story_flags = story_flags
+        self.visited = visited
+        self.version = version
+        self.dirty = False
+
+    @classmethod
+    def from_row(cls, player_id, row):
+        location_id, version, inventory, story_flags, visited = row
+        return cls(player_id, location_id, Bitset(inventory), Bitset(story_flags), Bitset(visited), version)
+
+    def move_to(self, location_id):
+        self.location_id = location_id
+        self.visited.add(location_id)
+        self.dirty = True
+
+    def grant_item(self, item_id):
+        self.inventory.add(item_id)
+        self.dirty = True
+
+    def activate_flag(self, story_flag_id):
+        self.story_flags.add(story_flag_id)
+        self.dirty = True
+
+    def save(self, tx, now):
+        # writes the whole row (and last_active_at) through a store writer (see app/storage.py),
+        # the caller commits it along with the rest of the turn. returns whether anything was written
+        if not self.dirty:
+            return False
+        saved = tx.update_player(
+            self.player_id, self.location_id, self.inventory.to_bytes(), self.story_flags.to_bytes(),
+            self.visited.to_bytes(), now, self.version,
+        )
+        if not saved:
+            raise StalePlayerState(self.player_id)
+        self.version += 1
+        self.dirty = False
+        return True
+
+def load_player_state(store, player_id):
+    row = store.get_player(player_id)
+    if row is None:
+        return None
+    return PlayerState.from_row(player_id, row)
+
+def get_player_state(store, player_id):
+    # one load per request no matter how many places ask for it
+    state = g.get('player_state')
+    if state is None or state.player_id != player_id:
+        state = load_player_state(store, player_id)
+        g.player_state = state
+    return state
+
+def remember_player_state(state):
+    # called once the turn has committed, so later reads in this request see it
+    g.player_state = state
+
+def forget_player_state(player_id):
+    g.pop('player_state', None)
@@ -0,0 +1,17 @@
+from flask import current_app
+
+# story log entries are paged by log_id (autoincrement, see migration 2) so that a page
+# never depends on how much history the player has built up. the queries themselves live
+# in the player store (app/storage.py)
+
+def get_page_size(): 
+    return current_app.config.get('STORY_LOG_PAGE_SIZE', 100)
+
+def get_latest_entries(store, player_id, limit=None): 
+    return store.get_log_latest(player_id, limit or get_page_size())
+
+def get_entries_before(store, player_id, cursor, limit=None): 
+    return store.get_log_before(player_id, cursor, limit or get_page_size())
+
+def get_entries_after(store, player_id, cursor, limit=None): 
+    return store.get_log_after(player_id, cursor, limit or get_page_size())
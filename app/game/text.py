@@ -0,0 +1,22 @@
+def build_string_of_list(list): 
+    result = ""
+    for i in range(len(list)): 
+        result += list[i]
+        if i != len(list) - 1: 
+            result += " "
+    return result
+
+def build_string_of_list_w_commas(list): 
+    result = ""
+    for i in range(len(list)): 
+        result += list[i]
+        if i == len(list) - 2:
+            result += ", and "
+        elif i != len(list) - 1: 
+            result += ", "
+    return result
+
+# story log entries that read the same for every player besides the ones from the world content
+# (see WorldModel.is_shared_text). the story log stores these once, in story_text, and refers to
+# them by id instead of repeating them for every player
+fixed_texts = set()
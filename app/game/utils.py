@@ -1,215 +1,222 @@
-from flask import session
-
-def initialize_new_player(db, player_id): 
-    story = [
-        ("You find yourself in an abandoned control room", "Description"), 
-        ("What would you like to do?", "Continue"), 
-        ("Available objects are: crates, door, control panel, and switches", "Hint"), 
-        ("See the side panel for room description. This will update as you change rooms.", "Instruction"), 
-        ("Hint: Try 'inspect boxes'", "Hint"), 
-        ("Enter 'help' for more assistance.", "Instruction"), 
-    ]
-
-    for entry, category in story: 
-        db.execute("INSERT OR IGNORE INTO story_log (player_id, entry, category) VALUES (?, ?, ?)", (player_id, entry, category))
-    
-    # just to make sure that the player's location is set
-    db.execute('UPDATE players SET current_location_id = ? WHERE player_id = ?', (0, player_id))
-    db.commit()
-
-def process(text, db, player_id): 
-    text = text.strip().lower()
-    s = ""
-    parts = text.split()
-    s = parse(parts, db, player_id)
-    for entry, category in s: 
-        db.execute('INSERT INTO story_log (player_id, entry, category) VALUES (?, ?, ?)', (player_id, entry, category))
-    db.commit()
-
-commands = ['inspect', 'open']
-
-def parse(parts, db, player_id): 
-    response = [("", "")]
-    entry = ""
-    if len(parts) < 1: 
-        response = [("Please enter at least one word", "Warning")]
-    elif len(parts) < 2: 
-        command = parts[0]
-        match command: 
-            case "clear": 
-                db.execute('DELETE FROM story_log WHERE player_id = ?', (player_id,))
-                response = [("Story log cleared", "Info")]
-            case "help": 
-                entry = "The available commands are "
-                for i, command in enumerate(commands): 
-                    if i == len(commands) - 1: 
-                        entry += command + ". "
-                    else: 
-                        entry += command + ", "
-                entry += "Additionally, you can use the clear command to clear the console, and the help command to view all possible commands. "
-                response = [(entry, "Hint")]
-                response.append(("Also, check the left side bar for a location, description, and available objects. ", "Hint"))
-            case "inventory": 
-                entry = "Inventory: "
-                cur = db.execute("SELECT item_name FROM inventory JOIN items ON inventory.item_id = items.item_id WHERE player_id = ?", (player_id, )).fetchall()
-                if not cur: 
-                    entry = "Your inventory is empty."
-                for i in range(len(cur)): 
-                    entry += cur[i]['item_name']
-                    if i < len(cur) - 1: 
-                        entry += ", "
-                response = [(entry, "Info")]
-            case _: 
-                response = [("The only valid one-word commands are 'clear', 'help', and 'inventory.'", "Warning")]
-        return response
-    else: 
-        command = parts[0].lower()
-        if command in commands: 
-            # get the objects currently in the room
-            room_id = get_curr_room_id(db=db)
-            object_rows = db.execute("SELECT * FROM objects WHERE location_id = ?", (room_id, ))
-            object_rows = object_rows.fetchall()
-            object_names_to_ids = {}
-            for row in object_rows: 
-                object_names_to_ids[row['name']] = row['object_id']
-                synonym_rows = db.execute("SELECT * FROM object_synonyms WHERE object_id = ?", (row['object_id'], ))
-                for s_row in synonym_rows: 
-                    object_names_to_ids[s_row['synonym']] = s_row['object_id']
-
-            if "with" in parts: 
-                with_index = parts.index("with")
-                target_object_items = parts[1:with_index - 1]
-                target_object = build_string_of_list(target_object_items)
-                target_item_items = parts[with_index + 1:]
-                target_item = build_string_of_list(target_item_items)
-            else: 
-                target_object_items = parts[1:]
-                target_object = build_string_of_list(target_object_items)
-            # check if the target object is valid
-            if target_object in object_names_to_ids: 
-                target_object_id = object_names_to_ids[target_object]
-                cur = db.execute("SELECT * FROM object_interactions WHERE object_id = ? AND action = ?", (target_object_id, command))
-                interaction_row = cur.fetchone()
-                if interaction_row: 
-                    story_flags = get_triggered_story_flag_ids(player_id, db)
-                    inventory_item_ids = get_inventory_item_ids(player_id, db)
-                    if interaction_row['requires_item_id'] is not None and interaction_row['requires_item_id'] not in inventory_item_ids: 
-                        if interaction_row['requirements_not_fulfilled_text']: 
-                            response = [(interaction_row['requirements_not_fulfilled_text'], "")]
-                        else: 
-                            response = [("You are unable to " + command + " the " + target_object + " yet. ", "Warning")]
-                    elif interaction_row['requires_story_flag_id'] is not None and interaction_row['requires_story_flag_id'] not in story_flags: 
-                        if interaction_row['requirements_not_fulfilled_text']: 
-                            response = [(interaction_row['requirements_not_fulfilled_text'], "")]
-                        else: 
-                            response = [("You are unable to " + command + " the " + target_object + " yet. ", "Warning")]
-                    else: 
-                        if interaction_row['requires_item_id']: 
-                            entry_1 = interaction_row['item_requirement_usage_description']
-                            response.append((entry_1, ""))
-                            if interaction_row['result']: 
-                                entry_2 = "\n" + interaction_row['result']
-                                response.append((entry_2, ""))
-                        if interaction_row['location_link_id']: 
-                            cur = db.execute("SELECT * FROM location_links WHERE location_link_id = ?", (interaction_row['location_link_id'], )).fetchone()
-                            entry_1 = cur['travel_description']
-                            new_room_id = cur['to_location_id']
-                            db.execute("UPDATE players SET current_location_id = ? WHERE player_id = ?", (new_room_id, player_id))
-                            cur = db.execute("SELECT * FROM locations WHERE location_id = ?", (new_room_id, )).fetchone()
-                            entry_2 = "You find yourself in " + cur['description']
-                            entry_3 = "Available objects are: "
-                            objects_in_new_room = db.execute("SELECT * FROM objects WHERE location_id = ?", (new_room_id, )).fetchall()
-                            list_of_objects_in_new_room = []
-                            for row in objects_in_new_room: 
-                                list_of_objects_in_new_room.append(row['name'])
-                            entry_3 += build_string_of_list_w_commas(list_of_objects_in_new_room)
-                            response.append((entry_1, ""))
-                            response.append((entry_2, ""))
-                            response.append((entry_3, "Hint"))
-                        if interaction_row['result']: 
-                            response.append((interaction_row['result'], ""))
-                        if interaction_row['gives_item_id'] is not None: # added is not None bc before 0 was registering as none
-                            # logic for adding item to inventory
-                            if interaction_row['gives_item_id'] in inventory_item_ids: 
-                                response = [(interaction_row['already_done_text'], "")]
-                            else: 
-                                db.execute("INSERT INTO inventory (player_id, item_id) VALUES (?, ?)", (player_id, interaction_row['gives_item_id']))
-                                item_name = db.execute("SELECT item_name FROM items WHERE item_id = ?", (interaction_row['gives_item_id'], )).fetchone()
-                                response.append(("+1: " + item_name['item_name'], "Info"))
-                                response.append(("Type 'inventory' to view full inventory. ", "Hint"))
-                        if interaction_row['activates_story_flag_id'] is not None: 
-                            cur = db.execute("SELECT * FROM triggered_story_flags WHERE story_flag_id = ? AND player_id = ?", (interaction_row['activates_story_flag_id'], player_id)).fetchone()
-                            if cur is not None: 
-                                response = [(interaction_row['already_done_text'], "")]
-                            else: 
-                                db.execute("INSERT INTO triggered_story_flags (player_id, story_flag_id) VALUES (?, ?)", (player_id, interaction_row['activates_story_flag_id']))
-                                story_flag_name = db.execute("SELECT * FROM story_flags WHERE story_flag_id = ?", (interaction_row['activates_story_flag_id'], )).fetchone()['flag_name']
-                                db.commit()
-                                response.append(("STORY FLAG ACTIVATED: " + story_flag_name, "Info"))
-                else: 
-                    if command == "inspect": 
-                        cur = db.execute("SELECT * FROM objects WHERE object_id = ?", (target_object_id, )).fetchone()
-                        response = [(cur['description'], "")]
-                    else: 
-                        response = [("You cannot " + command + " the " + target_object, "Warning")]
-            else: 
-                entry = "Please enter a valid object name. The available are: "
-                object_names_and_synonyms = list(object_names_to_ids.keys())
-                object_and_synonym_ids = list(object_names_to_ids.values())
-                most_recent_object_id = None
-                object_name_list = []
-                for i in range(len(object_and_synonym_ids)): 
-                    if not most_recent_object_id or object_and_synonym_ids[i] != most_recent_object_id: 
-                        object_name_list.append(object_names_and_synonyms[i])
-                    most_recent_object_id = object_and_synonym_ids[i]
-                entry += build_string_of_list_w_commas(object_name_list)
-                response = [(entry, "Warning")]
-        else: 
-            response = [("Please enter a valid command. Available commands are " + build_string_of_list_w_commas(commands), "Warning")]
-    db.commit()
-    text = ""
-    for row in response: 
-        text, category = row
-    if text != "": 
-        return response
-    else: 
-        return [(entry, "")]
-
-def get_triggered_story_flag_ids(player_id, db): 
-    cur = db.execute("SELECT story_flag_id FROM triggered_story_flags WHERE player_id = ?", (player_id, )).fetchall()
-    story_flag_ids = []
-    for row in cur: 
-        story_flag_ids.append(row['story_flag_id'])
-    return story_flag_ids
-
-def get_inventory_item_ids(player_id, db): 
-    cur = db.execute("SELECT item_id FROM inventory WHERE player_id = ?", (player_id, )).fetchall()
-    inventory_item_ids = []
-    for row in cur: 
-        inventory_item_ids.append(row['item_id'])
-    return inventory_item_ids
-
-def build_string_of_list(list): 
-    result = ""
-    for i in range(len(list)): 
-        result += list[i]
-        if i != len(list) - 1: 
-            result += " "
-    return result
-
-def build_string_of_list_w_commas(list): 
-    result = ""
-    for i in range(len(list)): 
-        result += list[i]
-        if i == len(list) - 2:
-            result += ", and "
-        elif i != len(list) - 1: 
-            result += ", "
-    return result
-
-def get_curr_room_id(db): 
+import time
+
+from flask import current_app, session
+from app.bitset import Bitset
+from app.metrics import tag_command
+from app.writer import turn_transaction
+from .world import get_world
+from .text import build_string_of_list, build_string_of_list_w_commas, fixed_texts
+from .rules import holds, run_rule
+from .fragments import arrival_entries
+from .grammar import ONE_WORD_VERBS, split_commands
+from .matching import canonical_tokens
+from .state import PlayerState, StalePlayerState, get_player_state, remember_player_state, forget_player_state
+
+# every new player starts with the same intro, so it is served straight from here until they
+# send their first command and actually get a row in the database
+STARTING_LOCATION_ID = 0
+
+INTRO_STORY = [
+    ("You find yourself in an abandoned control room", "Description"), 
+    ("What would you like to do?", "Continue"), 
+    ("Available objects are: crates, door, control panel, and switches", "Hint"), 
+    ("See the side panel for room description. This will update as you change rooms.", "Instruction"), 
+    ("Hint: Try 'inspect boxes'", "Hint"), 
+    ("Enter 'help' for more assistance.", "Instruction"), 
+]
+
+fixed_texts.update(entry for entry, _ in INTRO_STORY)
+
+def get_intro_story(): 
+    return [{'entry': entry, 'category': category} for entry, category in INTRO_STORY]
+
+def create_player(store): 
+    # player row and intro log go in together as one transaction
+    with store.transaction() as tx: 
+        player_id = tx.create_player(STARTING_LOCATION_ID)
+        tx.append_log(player_id, INTRO_STORY, get_world().is_shared_text)
+    remember_player_state(PlayerState(player_id, STARTING_LOCATION_ID, Bitset(), Bitset(), Bitset.of([STARTING_LOCATION_ID]), 0))
+    return player_id
+
+def get_or_create_player(store): 
     player_id = session.get('player_id')
-    cur = db.execute('SELECT * FROM players WHERE player_id = ?', (player_id,))
-    player = cur.fetchone()
-    location_id = player['current_location_id']
-    return location_id
\ No newline at end of file
+    if not player_id: 
+        player_id = create_player(store)
+        session['player_id'] = player_id
+        current_app.logger.debug("Created new player with id %s", player_id)
+    return player_id
+
+MAX_TURN_ATTEMPTS = 3
+
+def process(text, store, player_id): 
+    # a line can chain several commands with ';' (see grammar.py), they all go in the same turn
+    commands = split_commands(text)
+    limit = current_app.config.get('COMMAND_CHAIN_LIMIT', 10)
+    skipped = len(commands) - limit
+    commands = commands[:limit]
+    tag_command(command_label(commands))
+    for attempt in range(MAX_TURN_ATTEMPTS): 
+        state = get_player_state(store, player_id)
+        try: 
+            # the whole turn (player state and story log) is one short write transaction, or part of
+            # a group commit when there's a writer (see app/writer.py)
+            with turn_transaction(store) as tx: 
+                s = []
+                cleared = False
+                for parts in commands: 
+                    response = parse(parts, tx, state)
+                    if parts == ["clear"]: 
+                        # what the earlier commands of this turn said is cleared along with the rest
+                        s = []
+                        cleared = True
+                    s.extend(response)
+                if skipped > 0: 
+                    s.append(("Only the first " + str(limit) + " commands were run. ", "Warning"))
+                # last_active_at keeps retention from reaping players who are still playing. it goes
+                # in with the saved state, or on its own (at most every LAST_ACTIVE_RESOLUTION seconds)
+                now = int(time.time())
+                if not state.save(tx, now):
+                    tx.touch_player(player_id, now, now - current_app.config.get('LAST_ACTIVE_RESOLUTION', 300))
+                # hand back the new rows (with their log ids) so the json api can return just this turn
+                new_entries = tx.append_log(player_id, s, get_world().is_shared_text)
+        except StalePlayerState: 
+            # someone else moved this player on since we loaded them, reload and replay the command
+            forget_player_state(player_id)
+            if attempt == MAX_TURN_ATTEMPTS - 1: 
+                raise
+            continue
+        except Exception: 
+            forget_player_state(player_id)
+            raise
+        remember_player_state(state)
+        # whether a clear ran (commands past COMMAND_CHAIN_LIMIT don't), the client wipes its log too
+        return new_entries, cleared
+
+def command_label(commands): 
+    # anything else the player types is lumped together so /_metrics stays a fixed size
+    if len(commands) > 1: 
+        return "chain"
+    parts = commands[0]
+    if not parts: 
+        return "empty"
+    return get_world().grammar().verb(parts[0]) or "other"
+
+def clear_command(verb, words, tx, state): 
+    tx.clear_log(state.player_id)
+    return [("Story log cleared", "Info")]
+
+def help_command(verb, words, tx, state): 
+    entry = "The available commands are " + ", ".join(get_world().grammar().listed_verbs()) + ". "
+    entry += "Additionally, you can use the clear command to clear the console, and the help command to view all possible commands. "
+    response = [(entry, "Hint")]
+    response.append(("Also, check the left side bar for a location, description, and available objects. ", "Hint"))
+    return response
+
+def inventory_command(verb, words, tx, state): 
+    entry = "Inventory: "
+    world = get_world()
+    item_ids = sorted(state.inventory)
+    if not item_ids: 
+        entry = "Your inventory is empty."
+    for i in range(len(item_ids)): 
+        entry += world.items[item_ids[i]].item_name
+        if i < len(item_ids) - 1: 
+            entry += ", "
+    return [(entry, "Info")]
+
+def travel_command(verb, words, tx, state): 
+    # fast travel back to a room the player has been to, along the fewest links they can open with
+    # what they have, and only through rooms they've already seen (see app/game/graph.py)
+    world = get_world()
+    if words and words[0] == "to": 
+        words = words[1:]
+    if not words: 
+        return [("Where would you like to travel to? ", "Warning")]
+    name = build_string_of_list(words)
+    destination = world.find_location(name)
+    if destination is None or destination not in state.visited: 
+        return [("You don't know the way to " + name + ". ", "Warning")]
+    location = world.locations[destination]
+    if destination == state.location_id: 
+        return [("You are already in the " + location.location_name + ". ", "Info")]
+
+    path = world.graph().path(
+        state.location_id, destination, 
+        lambda requires: all(holds(state, condition) for condition in requires), 
+        state.visited.__contains__, 
+    )
+    if path is None: 
+        return [("You can't find a way back to the " + location.location_name + " from here. ", "Warning")]
+    state.move_to(destination)
+    response = [("", ""), ("You make your way to the " + location.location_name + ". ", "")]
+    response.extend(arrival_entries(world, destination))
+    return response
+
+def names_something(world, state, phrase): 
+    # the phrase after a preposition: something the player is carrying or an object in the room
+    tokens = canonical_tokens(phrase)
+    for item_id in state.inventory: 
+        if canonical_tokens(world.items[item_id].item_name) == tokens: 
+            return True
+    return world.resolve(state.location_id, phrase) is not None
+
+def object_command(verb, words, tx, state): 
+    # every verb from object_interactions.action: verb, object, and optionally "with/on/in <something>"
+    world = get_world()
+    room_id = state.location_id
+    if not words: 
+        if verb == "inspect": 
+            # "look" on its own looks around the room
+            return [("", "")] + list(arrival_entries(world, room_id))
+        return [("What would you like to " + verb + "? ", "Warning")]
+
+    def resolves(phrase_words): 
+        return world.resolve(room_id, build_string_of_list(phrase_words)) is not None
+
+    object_words, preposition, second_words = world.grammar().split_target(words, resolves)
+    target_object = build_string_of_list(object_words)
+    target_object_id = world.resolve(room_id, target_object)
+    if target_object_id is None: 
+        entry = "Please enter a valid object name. The available are: "
+        entry += build_string_of_list_w_commas(world.object_names(room_id))
+        return [(entry, "Warning")]
+    if preposition is not None: 
+        second = build_string_of_list(second_words)
+        if not second_words or not names_something(world, state, second): 
+            return [("You don't have " + (second or "anything") + " to " + verb + " the " + target_object + " " + preposition + ". ", "Warning")]
+
+    rule = world.rule(target_object_id, verb)
+    if rule: 
+        response = run_rule(rule, state, verb, target_object)
+    elif verb == "inspect": 
+        response = [(world.objects[target_object_id].description, "")]
+    else: 
+        response = [("You cannot " + verb + " the " + target_object, "Warning")]
+    # an interaction with nothing to say still leaves a blank line in the log
+    if not response or response[-1][0] == "": 
+        return [("", "")]
+    return response
+
+# verbs with their own handler, every other verb in the grammar is an object_command
+VERB_HANDLERS = {
+    'clear': clear_command, 
+    'help': help_command, 
+    'inventory': inventory_command, 
+    'travel': travel_command, 
+}
+
+def parse(parts, tx, state): 
+    # one command (a list of words), dispatched on its verb
+    if len(parts) < 1: 
+        return [("Please enter at least one word", "Warning")]
+    grammar = get_world().grammar()
+    verb = grammar.verb(parts[0])
+    words = parts[1:]
+    if verb in ONE_WORD_VERBS and words: 
+        verb = None
+    if verb is None: 
+        if words: 
+            return [("Please enter a valid command. Available commands are " + build_string_of_list_w_commas(grammar.listed_verbs()), "Warning")]
+        quoted = ["'" + word + "'" for word in grammar.one_word_commands()]
+        return [("The only valid one-word commands are " + build_string_of_list_w_commas(quoted) + ". ", "Warning")]
+    return VERB_HANDLERS.get(verb, object_command)(verb, words, tx, state)
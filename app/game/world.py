@@ -0,0 +1,268 @@
+import os
+import sqlite3
+import time
+
+from flask import current_app
+
+from app.worldbuild import read_world_version
+from .fragments import fragments
+from .grammar import Grammar
+from .graph import WorldGraph
+from .matching import build_room_matcher
+from .rules import compile_rules, rule_texts
+from .text import fixed_texts
+
+# the world tables (locations, objects, interactions, etc.) are written once by populate_db
+# and never change while the app is running, so they get loaded into memory once per worker
+# and parse/index read from here instead of querying sqlite on every command
+
+class Location:
+    __slots__ = ('location_id', 'location_name', 'description')
+
+    def __init__(self, location_id, location_name, description):
+        self.location_id = location_id
+        self.location_name = location_name
+        self.description = description
+
+class LocationLink:
+    __slots__ = ('location_link_id', 'to_location_id', 'from_location_id', 'travel_description')
+
+    def __init__(self, location_link_id, to_location_id, from_location_id, travel_description):
+        self.location_link_id = location_link_id
+        self.to_location_id = to_location_id
+        self.from_location_id = from_location_id
+        self.travel_description = travel_description
+
+class GameObject:
+    __slots__ = ('object_id', 'location_id', 'name', 'description')
+
+    def __init__(self, object_id, location_id, name, description):
+        self.object_id = object_id
+        self.location_id = location_id
+        self.name = name
+        self.description = description
+
+class Item:
+    __slots__ = ('item_id', 'item_name', 'description')
+
+    def __init__(self, item_id, item_name, description):
+        self.item_id = item_id
+        self.item_name = item_name
+        self.description = description
+
+class StoryFlag:
+    __slots__ = ('story_flag_id', 'flag_name')
+
+    def __init__(self, story_flag_id, flag_name):
+        self.story_flag_id = story_flag_id
+        self.flag_name = flag_name
+
+INTERACTION_COLUMNS = (
+    'interaction_id', 'object_id', 'action', 'result', 'requires_item_id', 'gives_item_id',
+    'already_done_text', 'location_link_id', 'item_requirement_usage_description',
+    'activates_story_flag_id', 'requires_story_flag_id', 'requirements_not_fulfilled_text',
+)
+
+class Interaction:
+    __slots__ = INTERACTION_COLUMNS
+
+    def __init__(self, **columns):
+        for column in INTERACTION_COLUMNS:
+            setattr(self, column, columns.get(column))
+
+    # parse was written against sqlite rows, so keep row-style access working
+    def __getitem__(self, column):
+        return getattr(self, column)
+
+def normalize_phrase(phrase):
+    return " ".join(phrase.lower().split())
+
+class WorldModel:
+    __slots__ = ('locations', 'location_links', 'objects', 'objects_by_location', 'synonyms_by_object', 'interactions', 'items', 'story_flags', 'resolver', 'object_names_by_location', 'rules', 'version', 'shared_texts', 'locations_by_name', 'graph_index', 'grammar_table')
+
+    def __init__(self):
+        self.locations = {}
+        self.location_links = {}
+        self.objects = {}
+        self.objects_by_location = {}
+        self.synonyms_by_object = {}
+        self.interactions = {}
+        self.items = {}
+        self.story_flags = {}
+        # (location_id, normalized phrase) -> object_id, covering names and synonyms
+        self.resolver = {}
+        self.object_names_by_location = {}
+        # (object_id, action) -> compiled Rule, see rules.py
+        self.rules = {}
+        # content version hash from world_meta (see app/worldbuild.py), None for unversioned databases
+        self.version = None
+        # everything the world can put in a story log, see is_shared_text
+        self.shared_texts = frozenset()
+        # normalized location name -> location_id, for `travel to <room>`
+        self.locations_by_name = {}
+        # built the first time something asks for them, see graph() and grammar()
+        self.graph_index = None
+        self.grammar_table = None
+
+    @classmethod
+    def from_db(cls, db):
+        world = cls()
+
+        for row in db.execute("SELECT location_id, location_name, description FROM locations ORDER BY location_id"):
+            world.locations[row[0]] = Location(row[0], row[1], row[2])
+            world.locations_by_name.setdefault(normalize_phrase(row[1]), row[0])
+
+        for row in db.execute("SELECT location_link_id, to_location_id, from_location_id, travel_description FROM location_links ORDER BY location_link_id"):
+            world.location_links[row[0]] = LocationLink(row[0], row[1], row[2], row[3])
+
+        objects_by_location = {}
+        for row in db.execute("SELECT object_id, location_id, name, description FROM objects ORDER BY object_id"):
+            obj = GameObject(row[0], row[1], row[2], row[3])
+            world.objects[obj.object_id] = obj
+            objects_by_location.setdefault(obj.location_id, []).append(obj)
+        world.objects_by_location = {location_id: tuple(objs) for location_id, objs in objects_by_location.items()}
+
+        synonyms_by_object = {}
+        for row in db.execute("SELECT object_id, synonym FROM object_synonyms ORDER BY object_id, synonym"):
+            synonyms_by_object.setdefault(row[0], []).append(row[1])
+        world.synonyms_by_object = {object_id: tuple(synonyms) for object_id, synonyms in synonyms_by_object.items()}
+
+        columns = ", ".join(INTERACTION_COLUMNS)
+        for row in db.execute(f"SELECT {columns} FROM object_interactions ORDER BY interaction_id"):
+            interaction = Interaction(**dict(zip(INTERACTION_COLUMNS, row)))
+            # the old per-command query used fetchone(), so the lowest interaction id wins
+            world.interactions.setdefault((interaction.object_id, interaction.action), interaction)
+
+        for row in db.execute("SELECT item_id, item_name, description FROM items ORDER BY item_id"):
+            world.items[row[0]] = Item(row[0], row[1], row[2])
+
+        for row in db.execute("SELECT story_flag_id, flag_name FROM story_flags ORDER BY story_flag_id"):
+            world.story_flags[row[0]] = StoryFlag(row[0], row[1])
+
+        world.version = read_world_version(db)
+
+        world.build_resolver()
+        world.rules = compile_rules(world)
+        world.shared_texts = world.collect_shared_texts()
+        return world
+
+    def collect_shared_texts(self):
+        texts = {obj.description for obj in self.objects.values() if obj.description}
+        for rule in self.rules.values():
+            texts.update(rule_texts(rule))
+        texts.discard("")
+        return frozenset(texts)
+
+    def is_shared_text(self, text):
+        # passed to the story log writers (app/storage.py) to decide which entries to intern
+        return text in self.shared_texts or text in fixed_texts
+
+    def build_resolver(self):
+        resolver = {}
+        for location_id, objs in self.objects_by_location.items():
+            # an object's own name always wins over another object's synonym, and otherwise
+            # the lowest object id wins, so the same phrase always resolves the same way
+            for obj in objs:
+                resolver[(location_id, normalize_phrase(obj.name))] = obj.object_id
+            for obj in objs:
+                for synonym in self.synonyms_by_object.get(obj.object_id, ()):
+                    resolver.setdefault((location_id, normalize_phrase(synonym)), obj.object_id)
+            self.object_names_by_location[location_id] = tuple(obj.name for obj in objs)
+        self.resolver = resolver
+
+    def resolve(self, location_id, phrase):
+        # exact names and synonyms first, then the room's fuzzy matcher (see matching.py)
+        object_id = self.resolver.get((location_id, normalize_phrase(phrase)))
+        if object_id is None and location_id in self.objects_by_location:
+            object_id = fragments.get(self, 'matcher', location_id, build_room_matcher).match(phrase)
+        return object_id
+
+    def object_names(self, location_id):
+        return self.object_names_by_location.get(location_id, ())
+
+    def objects_in(self, location_id):
+        return self.objects_by_location.get(location_id, ())
+
+    def interaction(self, object_id, action):
+        return self.interactions.get((object_id, action))
+
+    def rule(self, object_id, action):
+        return self.rules.get((object_id, action))
+
+    def find_location(self, name):
+        return self.locations_by_name.get(normalize_phrase(name))
+
+    def graph(self):
+        # the room graph (graph.py) only changes with the world, so it's built once per world
+        if self.graph_index is None:
+            self.graph_index = WorldGraph(self)
+        return self.graph_index
+
+    def grammar(self):
+        # the verbs come from object_interactions.action (see grammar.py), so they're per world too
+        if self.grammar_table is None:
+            self.grammar_table = Grammar(action for _, action in self.interactions)
+        return self.grammar_table
+
+def open_world_source(app):
+    # a snapshot from `flask build-world` wins if there is one, it's read-only and never changes
+    # underneath us, so sqlite can skip locking it entirely
+    snapshot = app.config.get('WORLD_SNAPSHOT')
+    if snapshot and os.path.exists(snapshot):
+        return sqlite3.connect(f"file:{snapshot}?mode=ro&immutable=1", uri=True)
+    return sqlite3.connect(app.config['DATABASE'])
+
+def snapshot_mtime(app):
+    snapshot = app.config.get('WORLD_SNAPSHOT')
+    try:
+        return os.stat(snapshot).st_mtime_ns if snapshot else None
+    except OSError:
+        return None
+
+def load_world(app):
+    # (re)builds the world model from the snapshot or the database and stores it on the app.
+    # fragments rendered from the old world go with it
+    mtime = snapshot_mtime(app)
+    db = open_world_source(app)
+    try:
+        fragments.clear()
+        world = WorldModel.from_db(db)
+    finally:
+        db.close()
+    app.extensions['world'] = world
+    app.extensions['world_snapshot_mtime'] = mtime
+    app.extensions['world_checked_at'] = time.monotonic()
+    return world
+
+def snapshot_changed(app):
+    # `flask build-world` renames the new snapshot over the old one, so a different mtime means a
+    # new world. checked at most every WORLD_RELOAD_INTERVAL seconds (0 turns it off)
+    interval = app.config.get('WORLD_RELOAD_INTERVAL', 0)
+    if not interval:
+        return False
+    now = time.monotonic()
+    if now - app.extensions.get('world_checked_at', 0) < interval:
+        return False
+    app.extensions['world_checked_at'] = now
+    return snapshot_mtime(app) != app.extensions.get('world_snapshot_mtime')
+
+def init_app(app):
+    app.extensions['world'] = None
+    fragments.max_entries = app.config.get('FRAGMENT_CACHE_SIZE', 10000)
+    # the database may not exist yet (wsgi.py creates it after create_app), in which case
+    # the world gets loaded the first time it's needed instead
+    snapshot = app.config.get('WORLD_SNAPSHOT')
+    if os.path.exists(app.config['DATABASE']) or (snapshot and os.path.exists(snapshot)):
+        try:
+            load_world(app)
+        except sqlite3.OperationalError:
+            app.extensions['world'] = None
+
+def get_world():
+    world = current_app.extensions.get('world')
+    if not world or not world.locations:
+        world = load_world(current_app)
+    elif snapshot_changed(current_app):
+        world = load_world(current_app)
+        current_app.logger.info("World snapshot changed, reloaded world %s", world.version)
+    return world
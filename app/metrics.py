@@ -0,0 +1,220 @@
+import hmac
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+
+# per-request sql instrumentation. every statement that goes through a pooled sqlite connection
+# (see connect in app/db.py) or the SQLAlchemy player store engine is counted, timed and tagged
+# with what it touches ("story_log insert", "players update", "begin"...). at the end of the
+# request the totals go out as response headers (debug mode), an optional Server-Timing header,
+# and into per-worker histograms per route and per command verb, served as json from /_metrics.
+#
+# recording a statement is a couple of perf_counter calls and dict updates, so it stays on in
+# production. /_metrics only reports the worker that answers it, and only exists when
+# METRICS_TOKEN is set: scrapers send it as "Authorization: Bearer <token>".
+
+# request latency bucket upper bounds, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float('inf'))
+
+TABLE_PATTERN = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+statement_tags = {}
+
+def statement_tag(sql):
+    # statements are mostly constant strings, so the tag is worked out once per distinct sql
+    tag = statement_tags.get(sql)
+    if tag is None:
+        words = sql.split(None, 2)
+        verb = words[0].lower() if words else ""
+        match = TABLE_PATTERN.search(sql)
+        if match:
+            tag = f"{match.group(1).lower()} {verb}"
+        elif verb in ('select', 'pragma') and len(words) > 1:
+            # SELECT last_insert_rowid(), PRAGMA user_version...
+            tag = f"{verb} {words[1].split('(')[0].split('=')[0].lower()}"
+        else:
+            tag = verb
+        if len(statement_tags) < 1000:
+            statement_tags[sql] = tag
+    return tag
+
+def record_statement(sql, elapsed):
+    if not has_request_context():
+        return
+    stats = g.get('sql_stats')
+    if stats is None:
+        stats = g.sql_stats = {}
+    tag = statement_tag(sql)
+    entry = stats.get(tag)
+    if entry is None:
+        stats[tag] = [1, elapsed]
+    else:
+        entry[0] += 1
+        entry[1] += elapsed
+
+class InstrumentedConnection(sqlite3.Connection):
+    # passed as the factory to sqlite3.connect. only the time spent in execute (which runs the
+    # statement up to its first row) is measured, fetching the rest of a large result isn't
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_statement(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            record_statement(sql, time.perf_counter() - started)
+
+    def executescript(self, script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            record_statement("script", time.perf_counter() - started)
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record_statement(statement, time.perf_counter() - conn.info['statement_started'].pop())
+
+    return engine
+
+def tag_command(verb):
+    # which histogram this request's command goes in, see process in app/game/utils.py
+    g.command_verb = verb
+
+class Histogram:
+    __slots__ = ('count', 'total_ms', 'sql_count', 'sql_ms', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def add(self, elapsed_ms, sql_count, sql_ms):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.sql_count += sql_count
+        self.sql_ms += sql_ms
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, fraction):
+        # upper bound of the bucket the quantile falls in
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= target and count:
+                return bound if bound != float('inf') else None
+        return None
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'sql_per_request': round(self.sql_count / self.count, 2) if self.count else 0,
+            'sql_ms_per_request': round(self.sql_ms / self.count, 3) if self.count else 0,
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): count for bound, count in zip(BUCKETS_MS, self.buckets)},
+        }
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.started_at = time.time()
+        self.routes = {}
+        self.commands = {}
+        self.statements = {}
+
+    def add(self, route, verb, elapsed_ms, stats):
+        sql_count = sum(entry[0] for entry in stats.values())
+        sql_ms = sum(entry[1] for entry in stats.values()) * 1000
+        with self.lock:
+            self.routes.setdefault(route, Histogram()).add(elapsed_ms, sql_count, sql_ms)
+            if verb is not None:
+                self.commands.setdefault(verb, Histogram()).add(elapsed_ms, sql_count, sql_ms)
+            for tag, (count, elapsed) in stats.items():
+                totals = self.statements.setdefault(tag, [0, 0.0])
+                totals[0] += count
+                totals[1] += elapsed * 1000
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'uptime_s': round(time.time() - self.started_at, 1),
+                'routes': {route: histogram.to_dict() for route, histogram in self.routes.items()},
+                'commands': {verb: histogram.to_dict() for verb, histogram in self.commands.items()},
+                'sql': {tag: {'count': count, 'total_ms': round(total_ms, 3)} for tag, (count, total_ms) in self.statements.items()},
+            }
+
+metrics_lock = threading.Lock()
+
+def get_metrics():
+    metrics = current_app.extensions.get('metrics')
+    # counts from before a fork belong to the parent process
+    if metrics is None or metrics.pid != os.getpid():
+        # threads racing here would otherwise each count into a Metrics of their own
+        with metrics_lock:
+            metrics = current_app.extensions.get('metrics')
+            if metrics is None or metrics.pid != os.getpid():
+                metrics = Metrics()
+                current_app.extensions['metrics'] = metrics
+    return metrics
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+def finish_request(response):
+    started = g.get('request_started')
+    if started is None or request.endpoint == 'static':
+        return response
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats = g.get('sql_stats') or {}
+    config = current_app.config
+
+    if config.get('METRICS_ENABLED', True):
+        route = f"{request.method} {request.url_rule.rule if request.url_rule else '<unmatched>'}"
+        get_metrics().add(route, g.get('command_verb'), elapsed_ms, stats)
+
+    sql_count = sum(entry[0] for entry in stats.values())
+    sql_ms = sum(entry[1] for entry in stats.values()) * 1000
+    if config.get('SQL_DEBUG_HEADERS') or (config.get('SQL_DEBUG_HEADERS') is None and current_app.debug):
+        response.headers['X-SQL-Count'] = str(sql_count)
+        response.headers['X-SQL-Time'] = f"{sql_ms:.3f}ms"
+        response.headers['X-SQL-Statements'] = ", ".join(f"{tag}={count}" for tag, (count, _) in sorted(stats.items()))
+    if config.get('SERVER_TIMING'):
+        response.headers['Server-Timing'] = f'sql;dur={sql_ms:.3f};desc="{sql_count} statements", app;dur={elapsed_ms:.3f}'
+    return response
+
+def metrics_endpoint():
+    expected = "Bearer " + current_app.config['METRICS_TOKEN']
+    if not hmac.compare_digest(request.headers.get('Authorization', "").encode('utf8'), expected.encode('utf8')):
+        return jsonify(error="unauthorized"), 401
+    return jsonify(get_metrics().to_dict())
+
+def init_app(app):
+    app.before_request(start_request_timer)
+    app.after_request(finish_request)
+    if app.config.get('METRICS_ENABLED', True) and app.config.get('METRICS_TOKEN'):
+        app.add_url_rule('/_metrics', 'metrics', metrics_endpoint)
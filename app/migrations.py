@@ -0,0 +1,174 @@
+from app.bitset import Bitset
+
+# schema.sql is the original (version 0) schema. every change to it after that goes in here as a
+# numbered migration so that existing databases can be brought up to date without being wiped.
+# the current version is stored in sqlite's built-in user_version pragma.
+
+def add_lookup_indexes(db):
+    db.execute("CREATE INDEX IF NOT EXISTS story_log_player_timestamp ON story_log (player_id, timestamp)")
+    db.execute("CREATE INDEX IF NOT EXISTS objects_location ON objects (location_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS object_interactions_object_action ON object_interactions (object_id, action)")
+    db.execute("CREATE INDEX IF NOT EXISTS location_links_from_location ON location_links (from_location_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS location_links_to_location ON location_links (to_location_id)")
+
+    # triggered_story_flags was created without a primary key, and sqlite can't add one to an
+    # existing table, so it gets rebuilt (dropping any duplicate rows on the way)
+    pk_columns = [row[1] for row in db.execute("PRAGMA table_info(triggered_story_flags)") if row[5]]
+    if not pk_columns:
+        db.execute("""
+            CREATE TABLE triggered_story_flags_new (
+                player_id INTEGER,
+                story_flag_id INTEGER,
+                PRIMARY KEY (player_id, story_flag_id),
+                FOREIGN KEY (player_id) REFERENCES players(player_id),
+                FOREIGN KEY (story_flag_id) REFERENCES story_flags(story_flag_id)
+            )
+        """)
+        db.execute("INSERT OR IGNORE INTO triggered_story_flags_new (player_id, story_flag_id) SELECT player_id, story_flag_id FROM triggered_story_flags")
+        db.execute("DROP TABLE triggered_story_flags")
+        db.execute("ALTER TABLE triggered_story_flags_new RENAME TO triggered_story_flags")
+
+def add_story_log_ids(db):
+    # timestamps only have one-second resolution, so entries logged in the same turn had no
+    # reliable order and nothing stable to paginate on. rebuild with an autoincrement id,
+    # keeping the old rowid order for existing entries
+    db.execute("""
+        CREATE TABLE story_log_new (
+            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player_id INTEGER,
+            entry TEXT,
+            category TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (player_id) REFERENCES players(player_id)
+        )
+    """)
+    db.execute("INSERT INTO story_log_new (log_id, player_id, entry, category, timestamp) SELECT rowid, player_id, entry, category, timestamp FROM story_log ORDER BY rowid")
+    db.execute("DROP TABLE story_log")
+    db.execute("ALTER TABLE story_log_new RENAME TO story_log")
+    db.execute("CREATE INDEX IF NOT EXISTS story_log_player_log_id ON story_log (player_id, log_id)")
+
+def add_player_state_version(db):
+    # bumped on every saved turn so per-worker player state caches can tell when they're stale
+    db.execute("ALTER TABLE players ADD COLUMN state_version INTEGER NOT NULL DEFAULT 0")
+
+def add_world_meta(db):
+    # records which version of the world content (see app/worldbuild.py) was loaded
+    db.execute("CREATE TABLE IF NOT EXISTS world_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+def add_player_last_active(db):
+    # unix time of the player's last turn, so retention (app/retention.py) can find abandoned
+    # sessions. existing players get the time of their newest log entry, or now if they have none
+    db.execute("ALTER TABLE players ADD COLUMN last_active_at INTEGER")
+    db.execute("""
+        UPDATE players SET last_active_at = COALESCE(
+            (SELECT CAST(strftime('%s', MAX(timestamp)) AS INTEGER) FROM story_log WHERE story_log.player_id = players.player_id),
+            CAST(strftime('%s', 'now') AS INTEGER)
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS players_last_active ON players (last_active_at)")
+
+def add_story_text(db):
+    # story log entries that every player gets (interaction results, room descriptions, the intro)
+    # are stored once in story_text and referenced by text_id, with story_log.entry left NULL.
+    # existing entries that appear more than once are interned on the way
+    db.execute("CREATE TABLE IF NOT EXISTS story_text (text_id INTEGER PRIMARY KEY AUTOINCREMENT, entry TEXT NOT NULL UNIQUE)")
+    db.execute("ALTER TABLE story_log ADD COLUMN text_id INTEGER REFERENCES story_text(text_id)")
+    db.execute("INSERT OR IGNORE INTO story_text (entry) SELECT entry FROM story_log WHERE entry != '' GROUP BY entry HAVING COUNT(*) > 1")
+    db.execute("""
+        UPDATE story_log SET text_id = (SELECT text_id FROM story_text WHERE story_text.entry = story_log.entry), entry = NULL
+        WHERE entry IN (SELECT entry FROM story_text)
+    """)
+
+def add_progress_bitsets(db):
+    # inventory, story flags and visited locations move from one row per entry in their own tables
+    # to bitset blobs on the players row (app/bitset.py). the old tables are left as they were
+    for column in ('inventory_bits', 'story_flag_bits', 'visited_bits'):
+        db.execute(f"ALTER TABLE players ADD COLUMN {column} BLOB")
+    for column, query in (
+        ('inventory_bits', "SELECT player_id, item_id FROM inventory ORDER BY player_id"),
+        ('story_flag_bits', "SELECT player_id, story_flag_id FROM triggered_story_flags ORDER BY player_id"),
+        ('visited_bits', "SELECT player_id, location_id FROM player_locations WHERE visited "
+                         "UNION SELECT player_id, current_location_id FROM players WHERE current_location_id IS NOT NULL ORDER BY player_id"),
+    ):
+        updates = []
+        player_id, bitset = None, None
+        for row_player_id, value in db.execute(query).fetchall():
+            if row_player_id != player_id:
+                if bitset is not None:
+                    updates.append((bitset.to_bytes(), player_id))
+                player_id, bitset = row_player_id, Bitset()
+            bitset.add(value)
+        if bitset is not None:
+            updates.append((bitset.to_bytes(), player_id))
+        db.executemany(f"UPDATE players SET {column} = ? WHERE player_id = ?", updates)
+
+def add_player_id_autoincrement(db):
+    # retention deletes players, and without AUTOINCREMENT sqlite hands the highest deleted id to
+    # the next new player, who would then be picked up by the old player's session cookie (and any
+    # of their story_log rows not swept yet). rebuild players with AUTOINCREMENT, starting the
+    # sequence past every id still mentioned in story_log as well
+    db.execute("""
+        CREATE TABLE players_new (
+            player_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            current_location_id INTEGER,
+            state_version INTEGER NOT NULL DEFAULT 0,
+            last_active_at INTEGER,
+            inventory_bits BLOB,
+            story_flag_bits BLOB,
+            visited_bits BLOB,
+            FOREIGN KEY (current_location_id) REFERENCES locations(location_id)
+        )
+    """)
+    columns = "player_id, current_location_id, state_version, last_active_at, inventory_bits, story_flag_bits, visited_bits"
+    db.execute(f"INSERT INTO players_new ({columns}) SELECT {columns} FROM players ORDER BY player_id")
+    db.execute("DROP TABLE players")
+    db.execute("ALTER TABLE players_new RENAME TO players")
+    db.execute("CREATE INDEX IF NOT EXISTS players_last_active ON players (last_active_at)")
+    highest = db.execute("SELECT MAX(player_id) FROM (SELECT player_id FROM players UNION ALL SELECT player_id FROM story_log)").fetchone()[0]
+    if highest is not None:
+        db.execute("DELETE FROM sqlite_sequence WHERE name = 'players'")
+        db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('players', ?)", (highest,))
+
+# (version, description, function) -- append only, never edit a migration that has shipped
+MIGRATIONS = [
+    (1, "indexes for player lookups and a primary key on triggered_story_flags", add_lookup_indexes),
+    (2, "autoincrement log_id on story_log for cursor pagination", add_story_log_ids),
+    (3, "state_version on players for player state caching", add_player_state_version),
+    (4, "world_meta table for the world content version", add_world_meta),
+    (5, "last_active_at on players for retention", add_player_last_active),
+    (6, "story_text for entries shared between players", add_story_text),
+    (7, "inventory, story flags and visited locations as bitsets on players", add_progress_bitsets),
+    (8, "autoincrement player_id so reaped players' ids are never reused", add_player_id_autoincrement),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(db, log=None):
+    current_version = get_schema_version(db)
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        # each migration and its version bump go in together or not at all
+        if db.in_transaction:
+            db.commit()
+        db.execute("BEGIN IMMEDIATE")
+        # workers migrate as they boot, so another one may have got here while we waited for the lock
+        current_version = get_schema_version(db)
+        if version <= current_version:
+            db.rollback()
+            continue
+        if log:
+            log(f"Applying migration {version}: {description}")
+        try:
+            migration(db)
+            db.execute(f"PRAGMA user_version = {version}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append(version)
+    return applied
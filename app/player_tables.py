@@ -0,0 +1,64 @@
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, LargeBinary, MetaData, PrimaryKeyConstraint, Table, Text, func
+
+# the player tables for SQLAlchemyPlayerStore. these mirror schema.sql plus app/migrations.py,
+# minus the foreign keys into the world tables, which stay in the local sqlite file
+
+metadata = MetaData()
+
+players = Table(
+    'players', metadata,
+    Column('player_id', Integer, primary_key=True, autoincrement=True),
+    Column('current_location_id', Integer),
+    Column('state_version', Integer, nullable=False, server_default='0'),
+    Column('last_active_at', Integer),
+    # bitsets, see app/bitset.py
+    Column('inventory_bits', LargeBinary),
+    Column('story_flag_bits', LargeBinary),
+    Column('visited_bits', LargeBinary),
+    Index('players_last_active', 'last_active_at'),
+    # on sqlite autoincrement=True alone doesn't emit AUTOINCREMENT, and ids of deleted rows would
+    # be handed out again (see the AUTOINCREMENT migrations in app/migrations.py)
+    sqlite_autoincrement=True,
+)
+
+story_text = Table(
+    'story_text', metadata,
+    Column('text_id', Integer, primary_key=True, autoincrement=True),
+    Column('entry', Text, nullable=False, unique=True),
+)
+
+story_log = Table(
+    'story_log', metadata,
+    Column('log_id', Integer, primary_key=True, autoincrement=True),
+    Column('player_id', Integer, nullable=False),
+    Column('entry', Text),
+    Column('category', Text),
+    Column('text_id', Integer),
+    Column('timestamp', DateTime, server_default=func.current_timestamp()),
+    Index('story_log_player_log_id', 'player_id', 'log_id'),
+    # log ids are the /api/log cursors and retention's delete bounds, they must never go backwards
+    sqlite_autoincrement=True,
+)
+
+inventory = Table(
+    'inventory', metadata,
+    Column('player_id', Integer, nullable=False),
+    Column('item_id', Integer, nullable=False),
+    PrimaryKeyConstraint('player_id', 'item_id'),
+)
+
+triggered_story_flags = Table(
+    'triggered_story_flags', metadata,
+    Column('player_id', Integer, nullable=False),
+    Column('story_flag_id', Integer, nullable=False),
+    PrimaryKeyConstraint('player_id', 'story_flag_id'),
+)
+
+player_locations = Table(
+    'player_locations', metadata,
+    Column('player_id', Integer, nullable=False),
+    Column('location_id', Integer, nullable=False),
+    Column('unlocked', Boolean, server_default='0'),
+    Column('visited', Boolean, server_default='0'),
+    PrimaryKeyConstraint('player_id', 'location_id'),
+)
@@ -0,0 +1,121 @@
+import gzip
+import json
+import os
+import time
+
+# retention for player data, run with `flask retention` (from cron or a systemd timer):
+#
+#   1. players whose last turn is older than the cutoff are deleted, with their inventory, story
+#      flags and player_locations rows
+#   2. story_log rows that no longer have a player (just reaped, or left over from an earlier run
+#      that was interrupted) are archived and deleted
+#   3. players with more than max_log_entries log entries get their oldest ones archived and deleted
+#   4. the store is compacted (for sqlite: checkpoint and truncate the WAL, optionally VACUUM)
+#
+# everything goes in batches of batch_size rows, each batch its own short write transaction with a
+# pause after it, so turns being played at the same time only ever wait for one small batch.
+# entries are written to the archive (and flushed) before the transaction that deletes them.
+
+class LogArchive:
+    # gzipped json lines, one file per run: story_log-<utc time>-<pid>.jsonl.gz
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = None
+        self.raw = None
+        self.file = None
+        self.entries = 0
+
+    def write(self, rows):
+        if self.file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            name = time.strftime('story_log-%Y%m%dT%H%M%SZ', time.gmtime()) + f"-{os.getpid()}.jsonl.gz"
+            self.path = os.path.join(self.directory, name)
+            self.raw = open(self.path, 'ab')
+            self.file = gzip.GzipFile(fileobj=self.raw, mode='ab')
+        for row in rows:
+            self.file.write((json.dumps(row, default=str, ensure_ascii=False) + "\n").encode('utf8'))
+        # everything written so far has to be readable from disk before the rows are deleted
+        self.file.flush()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.entries += len(rows)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.raw.close()
+            self.file = None
+
+def remove_log_entries(store, player_id, before_log_id, archive, batch_size, pause):
+    # archives then deletes the player's entries older than before_log_id (all of them for None)
+    removed = 0
+    while True:
+        rows = store.get_log_for_archive(player_id, before_log_id, batch_size)
+        if not rows:
+            return removed
+        if archive is not None:
+            archive.write(rows)
+        with store.transaction() as tx:
+            tx.delete_log_entries(player_id, rows[-1]['id'])
+        removed += len(rows)
+        time.sleep(pause)
+        if len(rows) < batch_size:
+            return removed
+
+def reap_inactive_players(store, cutoff, batch_size, pause):
+    reaped = 0
+    while True:
+        player_ids = store.get_inactive_players(cutoff, batch_size)
+        if not player_ids:
+            return reaped
+        with store.transaction() as tx:
+            deleted = tx.delete_inactive_players(player_ids, cutoff)
+        # players who came back in the meantime aren't deleted, and aren't picked again either
+        # (they're no longer inactive), so keep going until the query comes back empty
+        reaped += len(deleted)
+        time.sleep(pause)
+
+def remove_orphaned_logs(store, archive, batch_size, pause):
+    removed = 0
+    while True:
+        player_ids = store.get_orphaned_log_players(batch_size)
+        if not player_ids:
+            return removed
+        for player_id in player_ids:
+            removed += remove_log_entries(store, player_id, None, archive, batch_size, pause)
+
+def cap_log_lengths(store, max_entries, archive, batch_size, pause):
+    removed = 0
+    after_player_id = 0
+    while True:
+        player_ids = store.get_players_over_log_limit(max_entries, after_player_id, batch_size)
+        if not player_ids:
+            return removed
+        for player_id in player_ids:
+            cutoff = store.get_log_cutoff(player_id, max_entries)
+            if cutoff is not None:
+                removed += remove_log_entries(store, player_id, cutoff, archive, batch_size, pause)
+        after_player_id = player_ids[-1]
+
+def run_retention(store, inactive_days, max_log_entries, archive_dir, batch_size=500, pause=0.05, vacuum=False, log=None):
+    log = log or (lambda message: None)
+    archive = LogArchive(archive_dir) if archive_dir else None
+    results = {}
+    try:
+        if inactive_days:
+            cutoff = int(time.time()) - int(inactive_days * 86400)
+            results['players_reaped'] = reap_inactive_players(store, cutoff, batch_size, pause)
+            log(f"Reaped {results['players_reaped']} players inactive for more than {inactive_days} days")
+        results['orphaned_entries_removed'] = remove_orphaned_logs(store, archive, batch_size, pause)
+        log(f"Removed {results['orphaned_entries_removed']} story log entries of deleted players")
+        if max_log_entries:
+            results['old_entries_removed'] = cap_log_lengths(store, max_log_entries, archive, batch_size, pause)
+            log(f"Removed {results['old_entries_removed']} story log entries beyond {max_log_entries} per player")
+    finally:
+        if archive is not None:
+            archive.close()
+    if archive is not None and archive.entries:
+        results['archive'] = archive.path
+        log(f"Archived {archive.entries} entries to {archive.path}")
+    store.compact(vacuum=vacuum)
+    return results
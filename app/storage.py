@@ -0,0 +1,433 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+from sqlalchemy import create_engine, delete, func, insert, inspect, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app.bitset import Bitset
+from app.metrics import instrument_engine
+from app.db import get_db, get_read_db, write_transaction, insert_story_log_entries
+from app.player_tables import metadata, players, story_log, story_text, inventory, triggered_story_flags, player_locations
+
+# the world (locations, objects, interactions...) always comes from the local sqlite file, but
+# everything that belongs to a player (players, story_log, story_text) goes through a PlayerStore
+# so it can live somewhere else. a player's inventory, story flags and visited locations are
+# bitset blobs on their players row (see app/game/state.py); the old inventory,
+# triggered_story_flags and player_locations tables are only read by the migration to them.
+#
+#   PLAYER_DATABASE_URL unset           -> SQLitePlayerStore, same file as the world (the default)
+#   PLAYER_DATABASE_URL=postgresql://.. -> SQLAlchemyPlayerStore, pooled, shared between nodes
+#
+# reads go straight through the store, writes go through store.transaction(), which hands back a
+# writer whose changes are committed together when the block exits.
+#
+# story log entries that are the same for every player (the writer is told which with an
+# is_shared callable, see WorldModel.is_shared_text) are interned in story_text and stored as a
+# text_id; reads join them back in. each store keeps the text -> text_id map of the texts it has
+# seen committed, so a turn usually interns without a single extra statement.
+#
+# the get_*/delete_* methods further down each class are for retention (app/retention.py), which
+# works in small batches so no single transaction holds the write lock for long.
+
+def log_row_to_dict(row):
+    return {'id': row[0], 'entry': row[1], 'category': row[2]}
+
+def trim_page(rows, limit):
+    # pages are fetched with limit + 1 rows to find out whether there's more beyond them
+    return rows[:limit], len(rows) > limit
+
+def archive_row_to_dict(row):
+    return {'id': row[0], 'player_id': row[1], 'entry': row[2], 'category': row[3], 'timestamp': row[4]}
+
+def placeholders(values):
+    return ", ".join("?" for _ in values)
+
+def shared_entries(entries, is_shared):
+    if is_shared is None:
+        return set()
+    return {entry for entry, _ in entries if entry and is_shared(entry)}
+
+# story_log joined with story_text, the entry column is whichever of the two is set
+LOG_COLUMNS = "story_log.log_id, COALESCE(story_text.entry, story_log.entry), story_log.category"
+LOG_FROM = "story_log LEFT JOIN story_text ON story_text.text_id = story_log.text_id"
+
+class SQLitePlayerStore:
+    name = 'sqlite'
+
+    def __init__(self):
+        self.text_ids = {}
+
+    def init_schema(self):
+        # schema.sql and app/migrations.py already cover the player tables
+        pass
+
+    def get_player(self, player_id):
+        # (location_id, state_version, inventory, story flags, visited), the last three as bitset blobs
+        row = get_read_db().execute(
+            "SELECT current_location_id, state_version, inventory_bits, story_flag_bits, visited_bits FROM players WHERE player_id = ?", (player_id,)
+        ).fetchone()
+        return None if row is None else tuple(row)
+
+    def get_log_latest(self, player_id, limit):
+        rows = get_read_db().execute(f"SELECT {LOG_COLUMNS} FROM {LOG_FROM} WHERE story_log.player_id = ? ORDER BY story_log.log_id DESC LIMIT ?", (player_id, limit + 1)).fetchall()
+        rows, has_more = trim_page(rows, limit)
+        rows.reverse()
+        return [log_row_to_dict(row) for row in rows], has_more
+
+    def get_log_before(self, player_id, cursor, limit):
+        rows = get_read_db().execute(f"SELECT {LOG_COLUMNS} FROM {LOG_FROM} WHERE story_log.player_id = ? AND story_log.log_id < ? ORDER BY story_log.log_id DESC LIMIT ?", (player_id, cursor, limit + 1)).fetchall()
+        rows, has_more = trim_page(rows, limit)
+        rows.reverse()
+        return [log_row_to_dict(row) for row in rows], has_more
+
+    def get_log_after(self, player_id, cursor, limit):
+        rows = get_read_db().execute(f"SELECT {LOG_COLUMNS} FROM {LOG_FROM} WHERE story_log.player_id = ? AND story_log.log_id > ? ORDER BY story_log.log_id ASC LIMIT ?", (player_id, cursor, limit + 1)).fetchall()
+        rows, has_more = trim_page(rows, limit)
+        return [log_row_to_dict(row) for row in rows], has_more
+
+    def get_inactive_players(self, cutoff, limit):
+        return [row[0] for row in get_read_db().execute("SELECT player_id FROM players WHERE last_active_at < ? LIMIT ?", (cutoff, limit))]
+
+    def get_orphaned_log_players(self, limit):
+        return [row[0] for row in get_read_db().execute(
+            "SELECT DISTINCT story_log.player_id FROM story_log LEFT JOIN players ON players.player_id = story_log.player_id WHERE players.player_id IS NULL LIMIT ?", (limit,)
+        )]
+
+    def get_players_over_log_limit(self, max_entries, after_player_id, limit):
+        return [row[0] for row in get_read_db().execute(
+            "SELECT player_id FROM story_log WHERE player_id > ? GROUP BY player_id HAVING COUNT(*) > ? ORDER BY player_id LIMIT ?", (after_player_id, max_entries, limit)
+        )]
+
+    def get_log_cutoff(self, player_id, keep):
+        # the oldest log_id of the newest `keep` entries
+        row = get_read_db().execute("SELECT log_id FROM story_log WHERE player_id = ? ORDER BY log_id DESC LIMIT 1 OFFSET ?", (player_id, keep - 1)).fetchone()
+        return None if row is None else row[0]
+
+    def get_log_for_archive(self, player_id, before_log_id, limit):
+        # oldest first, everything when before_log_id is None
+        rows = get_read_db().execute(
+            "SELECT story_log.log_id, story_log.player_id, COALESCE(story_text.entry, story_log.entry), story_log.category, story_log.timestamp "
+            f"FROM {LOG_FROM} WHERE story_log.player_id = ? AND story_log.log_id < ? ORDER BY story_log.log_id LIMIT ?",
+            (player_id, before_log_id if before_log_id is not None else 2 ** 63 - 1, limit),
+        )
+        return [archive_row_to_dict(row) for row in rows]
+
+    def compact(self, vacuum=False):
+        db = get_db()
+        if vacuum:
+            # rewrites the whole file and holds the write lock while it does, so it's opt-in
+            db.execute("VACUUM")
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    @contextmanager
+    def transaction(self):
+        db = get_db()
+        writer = SQLitePlayerWriter(db, self.text_ids)
+        with write_transaction(db):
+            yield writer
+        # only texts that are really in the database now go in the map
+        self.text_ids.update(writer.new_text_ids)
+
+class SQLitePlayerWriter:
+    def __init__(self, db, text_ids):
+        self.db = db
+        self.text_ids = text_ids
+        self.new_text_ids = {}
+
+    def intern_texts(self, texts):
+        text_ids = {}
+        for entry in texts:
+            text_id = self.text_ids.get(entry) or self.new_text_ids.get(entry)
+            if text_id is None:
+                self.db.execute("INSERT OR IGNORE INTO story_text (entry) VALUES (?)", (entry,))
+                text_id = self.db.execute("SELECT text_id FROM story_text WHERE entry = ?", (entry,)).fetchone()[0]
+                self.new_text_ids[entry] = text_id
+            text_ids[entry] = text_id
+        return text_ids
+
+    def create_player(self, location_id):
+        return self.db.execute(
+            "INSERT INTO players (current_location_id, last_active_at, visited_bits) VALUES (?, ?, ?)",
+            (location_id, int(time.time()), Bitset.of([location_id]).to_bytes()),
+        ).lastrowid
+
+    def touch_player(self, player_id, now, stale_before):
+        # only writes when the stored time is older than stale_before, so most turns change no pages
+        self.db.execute("UPDATE players SET last_active_at = ? WHERE player_id = ? AND (last_active_at IS NULL OR last_active_at < ?)", (now, player_id, stale_before))
+
+    def update_player(self, player_id, location_id, inventory, story_flags, visited, last_active_at, expected_version):
+        cur = self.db.execute(
+            "UPDATE players SET current_location_id = ?, inventory_bits = ?, story_flag_bits = ?, visited_bits = ?, last_active_at = ?, "
+            "state_version = state_version + 1 WHERE player_id = ? AND state_version = ?",
+            (location_id, inventory, story_flags, visited, last_active_at, player_id, expected_version),
+        )
+        return cur.rowcount > 0
+
+    def append_log(self, player_id, entries, is_shared=None):
+        return insert_story_log_entries(self.db, player_id, entries, self.intern_texts(shared_entries(entries, is_shared)))
+
+    def clear_log(self, player_id):
+        self.db.execute("DELETE FROM story_log WHERE player_id = ?", (player_id,))
+
+    def delete_inactive_players(self, player_ids, cutoff):
+        # checked again inside the transaction, a player may have come back since they were picked.
+        # their story_log rows are left to the orphaned log sweep, which archives them first
+        if not player_ids:
+            return []
+        player_ids = [row[0] for row in self.db.execute(
+            f"SELECT player_id FROM players WHERE player_id IN ({placeholders(player_ids)}) AND last_active_at < ?", (*player_ids, cutoff)
+        )]
+        if not player_ids:
+            return []
+        for table in ('inventory', 'triggered_story_flags', 'player_locations', 'players'):
+            self.db.execute(f"DELETE FROM {table} WHERE player_id IN ({placeholders(player_ids)})", player_ids)
+        return player_ids
+
+    def delete_log_entries(self, player_id, through_log_id):
+        self.db.execute("DELETE FROM story_log WHERE player_id = ? AND log_id <= ?", (player_id, through_log_id))
+
+class SQLAlchemyPlayerStore:
+    name = 'sqlalchemy'
+
+    def __init__(self, url, pool_size, max_overflow):
+        self.url = url
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pid = None
+        self._engine = None
+        self.engine_lock = threading.Lock()
+        self.text_ids = {}
+
+    @property
+    def engine(self):
+        # engines (and their pooled connections) can't be shared across a fork
+        if self._engine is None or self.pid != os.getpid():
+            # one engine (and pool) per process, however many threads get here first
+            with self.engine_lock:
+                if self._engine is None or self.pid != os.getpid():
+                    self._engine = instrument_engine(create_engine(self.url, pool_size=self.pool_size, max_overflow=self.max_overflow, pool_pre_ping=True))
+                    self.pid = os.getpid()
+        return self._engine
+
+    def init_schema(self):
+        metadata.create_all(self.engine)
+        # create_all doesn't touch existing tables, so columns added since go in by hand
+        columns = {column['name'] for column in inspect(self.engine).get_columns('players')}
+        if 'last_active_at' not in columns:
+            with self.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE players ADD COLUMN last_active_at INTEGER"))
+                conn.execute(update(players).values(last_active_at=int(time.time())))
+                conn.execute(text("CREATE INDEX players_last_active ON players (last_active_at)"))
+        columns = {column['name'] for column in inspect(self.engine).get_columns('story_log')}
+        if 'text_id' not in columns:
+            with self.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE story_log ADD COLUMN text_id INTEGER"))
+        columns = {column['name'] for column in inspect(self.engine).get_columns('players')}
+        if 'inventory_bits' not in columns:
+            blob = self.engine.dialect.type_compiler_instance.process(players.c.inventory_bits.type)
+            with self.engine.begin() as conn:
+                for column in ('inventory_bits', 'story_flag_bits', 'visited_bits'):
+                    conn.execute(text(f"ALTER TABLE players ADD COLUMN {column} {blob}"))
+                self._pack_progress(conn)
+
+    def _pack_progress(self, conn):
+        # one-off move from the inventory / triggered_story_flags / player_locations rows to the bitsets
+        progress = {}
+        def collect(column, rows):
+            for player_id, value in rows:
+                progress.setdefault(player_id, {}).setdefault(column, Bitset()).add(value)
+        collect('inventory_bits', conn.execute(select(inventory.c.player_id, inventory.c.item_id)))
+        collect('story_flag_bits', conn.execute(select(triggered_story_flags.c.player_id, triggered_story_flags.c.story_flag_id)))
+        collect('visited_bits', conn.execute(select(player_locations.c.player_id, player_locations.c.location_id).where(player_locations.c.visited)))
+        collect('visited_bits', conn.execute(select(players.c.player_id, players.c.current_location_id).where(players.c.current_location_id.is_not(None))))
+        for player_id, bitsets in progress.items():
+            conn.execute(update(players).where(players.c.player_id == player_id).values(**{column: bitset.to_bytes() for column, bitset in bitsets.items()}))
+
+    def get_player(self, player_id):
+        query = select(
+            players.c.current_location_id, players.c.state_version, players.c.inventory_bits, players.c.story_flag_bits, players.c.visited_bits,
+        ).where(players.c.player_id == player_id)
+        with self.engine.connect() as conn:
+            row = conn.execute(query).first()
+        return None if row is None else tuple(row)
+
+    def _log_page(self, player_id, limit, cursor_clause, newest_first):
+        query = (
+            select(story_log.c.log_id, func.coalesce(story_text.c.entry, story_log.c.entry), story_log.c.category)
+            .select_from(story_log.outerjoin(story_text, story_text.c.text_id == story_log.c.text_id))
+            .where(story_log.c.player_id == player_id)
+        )
+        if cursor_clause is not None:
+            query = query.where(cursor_clause(story_log.c.log_id))
+        query = query.order_by(story_log.c.log_id.desc() if newest_first else story_log.c.log_id.asc()).limit(limit + 1)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        rows, has_more = trim_page(rows, limit)
+        if newest_first:
+            rows.reverse()
+        return [log_row_to_dict(row) for row in rows], has_more
+
+    def get_log_latest(self, player_id, limit):
+        return self._log_page(player_id, limit, None, True)
+
+    def get_log_before(self, player_id, cursor, limit):
+        return self._log_page(player_id, limit, lambda log_id: log_id < cursor, True)
+
+    def get_log_after(self, player_id, cursor, limit):
+        return self._log_page(player_id, limit, lambda log_id: log_id > cursor, False)
+
+    def get_inactive_players(self, cutoff, limit):
+        with self.engine.connect() as conn:
+            return list(conn.execute(select(players.c.player_id).where(players.c.last_active_at < cutoff).limit(limit)).scalars())
+
+    def get_orphaned_log_players(self, limit):
+        query = (
+            select(story_log.c.player_id).distinct()
+            .select_from(story_log.outerjoin(players, players.c.player_id == story_log.c.player_id))
+            .where(players.c.player_id.is_(None)).limit(limit)
+        )
+        with self.engine.connect() as conn:
+            return list(conn.execute(query).scalars())
+
+    def get_players_over_log_limit(self, max_entries, after_player_id, limit):
+        query = (
+            select(story_log.c.player_id).where(story_log.c.player_id > after_player_id)
+            .group_by(story_log.c.player_id).having(func.count() > max_entries)
+            .order_by(story_log.c.player_id).limit(limit)
+        )
+        with self.engine.connect() as conn:
+            return list(conn.execute(query).scalars())
+
+    def get_log_cutoff(self, player_id, keep):
+        query = select(story_log.c.log_id).where(story_log.c.player_id == player_id).order_by(story_log.c.log_id.desc()).limit(1).offset(keep - 1)
+        with self.engine.connect() as conn:
+            return conn.execute(query).scalar()
+
+    def get_log_for_archive(self, player_id, before_log_id, limit):
+        query = (
+            select(story_log.c.log_id, story_log.c.player_id, func.coalesce(story_text.c.entry, story_log.c.entry), story_log.c.category, story_log.c.timestamp)
+            .select_from(story_log.outerjoin(story_text, story_text.c.text_id == story_log.c.text_id))
+            .where(story_log.c.player_id == player_id)
+        )
+        if before_log_id is not None:
+            query = query.where(story_log.c.log_id < before_log_id)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query.order_by(story_log.c.log_id).limit(limit)).all()
+        return [archive_row_to_dict(row) for row in rows]
+
+    def compact(self, vacuum=False):
+        # postgres and friends reclaim space on their own (autovacuum)
+        pass
+
+    @contextmanager
+    def transaction(self):
+        with self.engine.begin() as conn:
+            writer = SQLAlchemyPlayerWriter(conn, self.text_ids)
+            yield writer
+        self.text_ids.update(writer.new_text_ids)
+
+class SQLAlchemyPlayerWriter:
+    def __init__(self, conn, text_ids):
+        self.conn = conn
+        self.text_ids = text_ids
+        self.new_text_ids = {}
+
+    def insert_story_texts(self, entries):
+        # another worker may be interning the same texts at the same moment, whoever comes second
+        # keeps the row that's already there
+        dialect = self.conn.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            insert_ignoring = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            self.conn.execute(insert_ignoring(story_text).on_conflict_do_nothing(), [{'entry': entry} for entry in entries])
+            return
+        # no insert-ignore here: each text goes in under its own savepoint, so losing the race on
+        # the unique entry column doesn't abort the rest of the turn
+        for entry in entries:
+            try:
+                with self.conn.begin_nested():
+                    self.conn.execute(insert(story_text).values(entry=entry))
+            except IntegrityError:
+                pass
+
+    def intern_texts(self, texts):
+        text_ids = {}
+        missing = [entry for entry in texts if (self.text_ids.get(entry) or self.new_text_ids.get(entry)) is None]
+        if missing:
+            self.insert_story_texts(missing)
+            for text_id, entry in self.conn.execute(select(story_text.c.text_id, story_text.c.entry).where(story_text.c.entry.in_(missing))):
+                self.new_text_ids[entry] = text_id
+        for entry in texts:
+            text_ids[entry] = self.text_ids.get(entry) or self.new_text_ids[entry]
+        return text_ids
+
+    def create_player(self, location_id):
+        result = self.conn.execute(insert(players).values(
+            current_location_id=location_id, last_active_at=int(time.time()), visited_bits=Bitset.of([location_id]).to_bytes(),
+        ))
+        return result.inserted_primary_key[0]
+
+    def touch_player(self, player_id, now, stale_before):
+        self.conn.execute(
+            update(players)
+            .where(players.c.player_id == player_id, (players.c.last_active_at.is_(None)) | (players.c.last_active_at < stale_before))
+            .values(last_active_at=now)
+        )
+
+    def update_player(self, player_id, location_id, inventory, story_flags, visited, last_active_at, expected_version):
+        result = self.conn.execute(
+            update(players)
+            .where(players.c.player_id == player_id, players.c.state_version == expected_version)
+            .values(
+                current_location_id=location_id, inventory_bits=inventory, story_flag_bits=story_flags, visited_bits=visited,
+                last_active_at=last_active_at, state_version=players.c.state_version + 1,
+            )
+        )
+        return result.rowcount > 0
+
+    def append_log(self, player_id, entries, is_shared=None):
+        if not entries:
+            return []
+        text_ids = self.intern_texts(shared_entries(entries, is_shared))
+        result = self.conn.execute(
+            insert(story_log).returning(story_log.c.log_id, sort_by_parameter_order=True),
+            [
+                {'player_id': player_id, 'entry': None if entry in text_ids else entry, 'category': category, 'text_id': text_ids.get(entry)}
+                for entry, category in entries
+            ],
+        )
+        log_ids = result.scalars().all()
+        return [{'id': log_id, 'entry': entry, 'category': category} for log_id, (entry, category) in zip(log_ids, entries)]
+
+    def clear_log(self, player_id):
+        self.conn.execute(delete(story_log).where(story_log.c.player_id == player_id))
+
+    def delete_inactive_players(self, player_ids, cutoff):
+        if not player_ids:
+            return []
+        player_ids = list(self.conn.execute(
+            select(players.c.player_id).where(players.c.player_id.in_(player_ids), players.c.last_active_at < cutoff).with_for_update()
+        ).scalars())
+        if not player_ids:
+            return []
+        for table in (inventory, triggered_story_flags, player_locations, players):
+            self.conn.execute(delete(table).where(table.c.player_id.in_(player_ids)))
+        return player_ids
+
+    def delete_log_entries(self, player_id, through_log_id):
+        self.conn.execute(delete(story_log).where(story_log.c.player_id == player_id, story_log.c.log_id <= through_log_id))
+
+def create_store(config):
+    url = config.get('PLAYER_DATABASE_URL')
+    if not url:
+        return SQLitePlayerStore()
+    return SQLAlchemyPlayerStore(url, config.get('PLAYER_DB_POOL_SIZE', 5), config.get('PLAYER_DB_MAX_OVERFLOW', 10))
+
+def init_app(app):
+    app.extensions['player_store'] = create_store(app.config)
+
+def get_store():
+    return current_app.extensions['player_store']
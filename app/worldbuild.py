@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# world content is authored as json files in app/content (one file per table, a list of rows each)
+# and compiled into a read-only sqlite snapshot with `flask build-world`. the compiler checks
+# every reference between tables before anything is written, and stamps the snapshot with a
+# version hash of the content so workers (and the fragment caches) can tell worlds apart.
+
+# table -> (primary key columns, all columns), in the order they get loaded
+WORLD_TABLES = {
+    'locations': (('location_id',), ('location_id', 'location_name', 'description')),
+    'location_links': (('location_link_id',), ('location_link_id', 'to_location_id', 'from_location_id', 'travel_description')),
+    'objects': (('object_id',), ('object_id', 'location_id', 'name', 'description')),
+    'object_synonyms': (('object_id', 'synonym'), ('object_id', 'synonym')),
+    'items': (('item_id',), ('item_id', 'item_name', 'description')),
+    'story_flags': (('story_flag_id',), ('story_flag_id', 'flag_name')),
+    'object_interactions': (('interaction_id',), (
+        'interaction_id', 'object_id', 'action', 'result', 'requires_item_id', 'gives_item_id',
+        'already_done_text', 'location_link_id', 'item_requirement_usage_description',
+        'activates_story_flag_id', 'requires_story_flag_id', 'requirements_not_fulfilled_text',
+    )),
+}
+
+# (table, column, referenced table) -- None values are allowed, anything else has to exist
+REFERENCES = [
+    ('location_links', 'to_location_id', 'locations'),
+    ('location_links', 'from_location_id', 'locations'),
+    ('objects', 'location_id', 'locations'),
+    ('object_synonyms', 'object_id', 'objects'),
+    ('object_interactions', 'object_id', 'objects'),
+    ('object_interactions', 'location_link_id', 'location_links'),
+    ('object_interactions', 'requires_item_id', 'items'),
+    ('object_interactions', 'gives_item_id', 'items'),
+    ('object_interactions', 'requires_story_flag_id', 'story_flags'),
+    ('object_interactions', 'activates_story_flag_id', 'story_flags'),
+]
+
+SNAPSHOT_SCHEMA = """
+CREATE TABLE locations (location_id INTEGER PRIMARY KEY, location_name TEXT NOT NULL, description TEXT);
+CREATE TABLE location_links (location_link_id INTEGER PRIMARY KEY, to_location_id INTEGER, from_location_id INTEGER, travel_description TEXT);
+CREATE TABLE objects (object_id INTEGER PRIMARY KEY, location_id INTEGER, name TEXT NOT NULL, description TEXT);
+CREATE TABLE object_synonyms (object_id INTEGER, synonym TEXT, PRIMARY KEY (object_id, synonym));
+CREATE TABLE items (item_id INTEGER PRIMARY KEY, item_name TEXT NOT NULL, description TEXT);
+CREATE TABLE story_flags (story_flag_id INTEGER PRIMARY KEY, flag_name TEXT NOT NULL);
+CREATE TABLE object_interactions (
+    interaction_id INTEGER PRIMARY KEY, object_id INTEGER, action TEXT NOT NULL, result TEXT,
+    requires_item_id INTEGER, gives_item_id INTEGER, already_done_text TEXT, location_link_id INTEGER,
+    item_requirement_usage_description TEXT, activates_story_flag_id INTEGER, requires_story_flag_id INTEGER,
+    requirements_not_fulfilled_text TEXT
+);
+CREATE TABLE world_meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE INDEX objects_location ON objects (location_id);
+CREATE INDEX object_interactions_object_action ON object_interactions (object_id, action);
+"""
+
+class WorldBuildError(Exception):
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} problem(s) in the world content:\n" + "\n".join(errors))
+        self.errors = errors
+
+def default_content_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content')
+
+def load_content(content_dir):
+    content = {}
+    for table, (_, columns) in WORLD_TABLES.items():
+        with open(os.path.join(content_dir, table + '.json'), encoding='utf8') as f:
+            rows = json.load(f)
+        # keys starting with an underscore are notes for whoever is writing the content
+        content[table] = [{column: row.get(column) for column in columns} for row in rows]
+    return content
+
+def validate_content(content):
+    errors = []
+    warnings = []
+    keys = {}
+    for table, (pk_columns, _) in WORLD_TABLES.items():
+        seen = set()
+        for row in content[table]:
+            key = tuple(row[column] for column in pk_columns)
+            if any(value is None for value in key):
+                errors.append(f"{table}: row with a missing {', '.join(pk_columns)}: {row}")
+            elif key in seen:
+                errors.append(f"{table}: duplicate {', '.join(pk_columns)} {key if len(key) > 1 else key[0]}")
+            seen.add(key)
+        keys[table] = {key[0] for key in seen} if len(pk_columns) == 1 else seen
+
+    for table, column, referenced in REFERENCES:
+        id_column = WORLD_TABLES[table][0][0]
+        for row in content[table]:
+            value = row[column]
+            if value is not None and value not in keys[referenced]:
+                errors.append(f"{table} {row[id_column]}: {column} {value} does not exist in {referenced}")
+
+    for row in content['object_interactions']:
+        if not row['action']:
+            errors.append(f"object_interactions {row['interaction_id']}: empty action")
+
+    # travelling through an object in one room to a link that starts somewhere else is almost
+    # always a copy-paste mistake, but it isn't fatal
+    objects = {row['object_id']: row for row in content['objects']}
+    links = {row['location_link_id']: row for row in content['location_links']}
+    for row in content['object_interactions']:
+        obj = objects.get(row['object_id'])
+        link = links.get(row['location_link_id'])
+        if obj and link and link['from_location_id'] != obj['location_id']:
+            warnings.append(f"object_interactions {row['interaction_id']}: object {obj['object_id']} is in location {obj['location_id']} but link {link['location_link_id']} starts at {link['from_location_id']}")
+
+    return errors, warnings
+
+def read_world_version(db):
+    # the version stamped by build-world / populate-db, None for databases from before world_meta
+    try:
+        row = db.execute("SELECT value FROM world_meta WHERE key = 'version'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+def content_version(content):
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf8')).hexdigest()[:16]
+
+def insert_content(db, content):
+    for table, (_, columns) in WORLD_TABLES.items():
+        placeholders = ", ".join("?" for _ in columns)
+        db.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+            [tuple(row[column] for column in columns) for row in content[table]],
+        )
+
+def write_snapshot(content, output_path):
+    return write_snapshot_chunks([content], output_path, content_version(content))
+
+def write_snapshot_chunks(chunks, output_path, version):
+    # chunks is any iterable of content dicts (see app/worldgen.py), all loaded in one transaction
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    # build next to the target and rename over it, so a running worker never sees half a snapshot
+    tmp_path = output_path + '.building'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    try:
+        db.executescript(SNAPSHOT_SCHEMA)
+        db.execute("BEGIN")
+        for chunk in chunks:
+            insert_content(db, chunk)
+        db.executemany("INSERT INTO world_meta (key, value) VALUES (?, ?)", [
+            ('version', version),
+            ('built_at', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+        ])
+        db.commit()
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    os.replace(tmp_path, output_path)
+    return version
+
+def build_world(content_dir, output_path):
+    content = load_content(content_dir)
+    errors, warnings = validate_content(content)
+    if errors:
+        raise WorldBuildError(errors)
+    version = write_snapshot(content, output_path)
+    return version, warnings
@@ -0,0 +1,147 @@
+import hashlib
+import random
+
+from app.worldbuild import WORLD_TABLES
+
+# synthetic worlds for benchmarks, load tests and `flask generate-world`, in the same shape as
+# app/content (so they go through validate_content / insert_content like the real one). the world
+# is a long corridor of rooms: every room has a crate with the key to its door, a door forward, a
+# door back and a few things to look at, every tenth room has a switch that the door nine rooms
+# on needs, and some rooms have a hatch back to an earlier room of the same section.
+# synthetic_walkthrough gives the commands that get a player from the first room to the last.
+#
+# iter_content hands the world out in chunks of rooms so a million-room world never has to be in
+# memory all at once; ids run on across chunks, so the chunks together are exactly generate_content.
+
+ADJECTIVES = ['dusty', 'flickering', 'cramped', 'humming', 'silent', 'frozen', 'dim', 'cluttered', 'sterile', 'flooded']
+ROOM_KINDS = ['storage bay', 'corridor', 'airlock', 'laboratory', 'cabin', 'engine room', 'galley', 'observation deck']
+FILLER_OBJECTS = ['lamp', 'console', 'locker', 'window', 'pipes', 'terminal', 'poster', 'bench']
+SYNONYM_PREFIXES = ['the', 'old', 'small', 'big', 'strange', 'broken', 'metal', 'nearby'] + ADJECTIVES
+
+FLAG_EVERY = 10
+
+def empty_content():
+    return {table: [] for table in WORLD_TABLES}
+
+class WorldGenerator:
+    def __init__(self, seed=0, fillers=2, synonyms=0, hatch_chance=0.2):
+        self.rng = random.Random(seed)
+        self.fillers = fillers
+        self.synonyms = synonyms
+        self.hatch_chance = hatch_chance
+        self.next_object_id = 0
+        self.next_link_id = 1
+        self.next_interaction_id = 0
+        self.content = empty_content()
+
+    def add_object(self, location_id, name, description, synonyms=()):
+        object_id = self.next_object_id
+        self.next_object_id += 1
+        self.content['objects'].append({'object_id': object_id, 'location_id': location_id, 'name': name, 'description': description})
+        # dense synonym sets: "the lamp", "dusty lamp"... on top of the hand-picked ones
+        extra = self.rng.sample(SYNONYM_PREFIXES, min(self.synonyms, len(SYNONYM_PREFIXES)))
+        for synonym in list(synonyms) + [f"{prefix} {name}" for prefix in extra]:
+            self.content['object_synonyms'].append({'object_id': object_id, 'synonym': synonym})
+        return object_id
+
+    def add_link(self, from_location_id, to_location_id, text):
+        link_id = self.next_link_id
+        self.next_link_id += 1
+        self.content['location_links'].append({
+            'location_link_id': link_id, 'to_location_id': to_location_id, 'from_location_id': from_location_id, 'travel_description': text,
+        })
+        return link_id
+
+    def add_interaction(self, object_id, action, result, **columns):
+        row = {
+            'interaction_id': self.next_interaction_id, 'object_id': object_id, 'action': action, 'result': result,
+            'requires_item_id': None, 'gives_item_id': None, 'already_done_text': None, 'location_link_id': None,
+            'item_requirement_usage_description': None, 'activates_story_flag_id': None, 'requires_story_flag_id': None,
+            'requirements_not_fulfilled_text': None,
+        }
+        row.update(columns)
+        self.content['object_interactions'].append(row)
+        self.next_interaction_id += 1
+
+    def add_location(self, location_id, locations):
+        rng = self.rng
+        name = f"{rng.choice(ADJECTIVES)} {rng.choice(ROOM_KINDS)} {location_id}"
+        self.content['locations'].append({'location_id': location_id, 'location_name': name.title(), 'description': f"a {name}. "})
+        self.content['items'].append({'item_id': location_id, 'item_name': f"key {location_id}", 'description': f"Opens the door out of room {location_id}. "})
+
+        crate = self.add_object(location_id, 'crate', "A battered supply crate. ", ('box', 'boxes', 'crates'))
+        self.add_interaction(crate, 'inspect', "Inside the crate you find a key. ", gives_item_id=location_id,
+                             already_done_text="The crate is empty. ")
+
+        for filler in rng.sample(FILLER_OBJECTS, min(self.fillers, len(FILLER_OBJECTS))):
+            obj = self.add_object(location_id, filler, f"A {rng.choice(ADJECTIVES)} {filler}. ")
+            self.add_interaction(obj, 'inspect', f"The {filler} is {rng.choice(ADJECTIVES)}. Nothing else stands out. ")
+
+        section = location_id // FLAG_EVERY
+        if location_id % FLAG_EVERY == 0:
+            self.content['story_flags'].append({'story_flag_id': section, 'flag_name': f"Power restored to section {section}"})
+            switch = self.add_object(location_id, 'switch', "A heavy breaker switch. ", ('lever', 'breaker'))
+            self.add_interaction(switch, 'inspect', "You throw the switch and hear machinery start up somewhere ahead. ",
+                                 activates_story_flag_id=section, already_done_text="The switch is already on. ")
+        elif rng.random() < self.hatch_chance:
+            # a shortcut back to an earlier room of this section, only once its power is on
+            target = rng.randrange(section * FLAG_EVERY, location_id)
+            hatch = self.add_object(location_id, 'hatch', "A maintenance hatch in the floor. ", ('trapdoor',))
+            self.add_interaction(hatch, 'open', None, requires_story_flag_id=section,
+                                 requirements_not_fulfilled_text="The hatch is sealed until the power comes back. ",
+                                 location_link_id=self.add_link(location_id, target, "You drop through the hatch and crawl along a duct. "))
+
+        if location_id > 0:
+            back = self.add_object(location_id, 'door back', "The door you came in through. ", ('back',))
+            self.add_interaction(back, 'open', None, location_link_id=self.add_link(location_id, location_id - 1, "You head back the way you came. "))
+
+        if location_id < locations - 1:
+            door = self.add_object(location_id, 'door', "A locked door leading further in. ", ('exit',))
+            columns = {
+                'requires_item_id': location_id,
+                'item_requirement_usage_description': "You unlock the door with the key. ",
+                'location_link_id': self.add_link(location_id, location_id + 1, "The door grinds open. "),
+            }
+            # the last room of each section stays shut until that section's switch is thrown
+            if location_id % FLAG_EVERY == FLAG_EVERY - 1:
+                columns['requires_story_flag_id'] = section
+                columns['requirements_not_fulfilled_text'] = "The door has no power. "
+            self.add_interaction(door, 'open', None, **columns)
+
+def iter_content(locations, seed=0, fillers=2, synonyms=0, chunk_size=10000):
+    generator = WorldGenerator(seed, fillers, synonyms)
+    for start in range(0, locations, chunk_size):
+        generator.content = empty_content()
+        for location_id in range(start, min(start + chunk_size, locations)):
+            generator.add_location(location_id, locations)
+        yield generator.content
+
+def synthetic_version(locations, seed, fillers, synonyms):
+    # hashing the parameters is enough, the same parameters always generate the same world
+    key = f"synthetic:{locations}:{seed}:{fillers}:{synonyms}"
+    return hashlib.sha256(key.encode('utf8')).hexdigest()[:16]
+
+def generate_content(locations, seed=0, fillers=2, synonyms=0):
+    content = empty_content()
+    for chunk in iter_content(locations, seed, fillers, synonyms):
+        for table, rows in chunk.items():
+            content[table].extend(rows)
+    return content
+
+def synthetic_walkthrough(content):
+    # per room: look at one of the fillers, take the key, throw the switch if there is one, move on
+    fillers = {}
+    for obj in content['objects']:
+        if obj['name'] in FILLER_OBJECTS:
+            fillers.setdefault(obj['location_id'], obj['name'])
+    locations = len(content['locations'])
+    commands = []
+    for location_id in range(locations):
+        if location_id in fillers:
+            commands.append("inspect " + fillers[location_id])
+        commands.append("inspect crate")
+        if location_id % FLAG_EVERY == 0:
+            commands.append("inspect switch")
+        if location_id < locations - 1:
+            commands.append("open door")
+    return commands
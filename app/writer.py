@@ -0,0 +1,301 @@
+import os
+import queue
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Listener
+
+from flask import current_app
+
+from app.game.state import StalePlayerState
+
+# group commit for turns. instead of every request opening its own write transaction (and every
+# worker queuing on sqlite's write lock), a turn records what it wants to write in a TurnRecorder
+# and hands that to a single writer, which commits whatever turns have queued up in one
+# transaction and answers each of them once it has committed. WRITE_MODE picks the writer:
+#
+#   direct  -> no writer, each turn is its own store.transaction() (the default)
+#   local   -> a GroupCommitter thread in each worker process, for threaded workers (not serve-async,
+#              whose single writer thread only ever has one turn in flight)
+#   service -> `flask writer`, one GroupCommitter serving every worker on the machine over a unix
+#              socket (multiprocessing.connection, authenticated with SECRET_KEY)
+#
+# a batch is whatever is queued when the writer gets to it, plus anything that arrives within
+# WRITE_BATCH_WINDOW_MS, up to WRITE_BATCH_MAX_TURNS turns. each turn's players update goes
+# first and is still checked against state_version, so a stale turn is left out of the batch
+# (and retried by process) without holding up the others. if a batch fails as a whole its turns
+# are retried one transaction each, so one bad turn can't fail the rest.
+#
+# reads are unaffected, they keep using their own WAL snapshots.
+
+class WriterUnavailable(Exception):
+    # the turn never reached the writer, so it's safe to write it some other way
+    pass
+
+class TurnRecorder:
+    # stands in for a store writer (see app/storage.py) during a turn and only records the calls
+    def __init__(self):
+        self.ops = []
+        self.log_entries = []
+
+    def update_player(self, player_id, location_id, inventory, story_flags, visited, last_active_at, expected_version):
+        # the version check happens when the writer applies it, see apply_turn
+        self.ops.append(('update_player', (player_id, location_id, inventory, story_flags, visited, last_active_at, expected_version)))
+        return True
+
+    def touch_player(self, player_id, now, stale_before):
+        self.ops.append(('touch_player', (player_id, now, stale_before)))
+
+    def clear_log(self, player_id):
+        self.ops.append(('clear_log', (player_id,)))
+
+    def append_log(self, player_id, entries, is_shared=None):
+        # callables don't travel to the writer, so which entries are shared is worked out here.
+        # the returned list gets the new rows (with their ids) once the turn has committed
+        shared = [entry for entry, _ in entries if entry and is_shared is not None and is_shared(entry)]
+        self.ops.append(('append_log', (player_id, list(entries), shared)))
+        return self.log_entries
+
+def apply_turn(tx, ops):
+    # returns the new log rows, or None if the player has moved on since the turn was played
+    for name, args in ops:
+        if name == 'update_player' and not tx.update_player(*args):
+            return None
+    new_entries = []
+    for name, args in ops:
+        if name == 'append_log':
+            player_id, entries, shared = args
+            new_entries.extend(tx.append_log(player_id, entries, set(shared).__contains__))
+        elif name != 'update_player':
+            getattr(tx, name)(*args)
+    return new_entries
+
+def write_turn(store, ops):
+    with store.transaction() as tx:
+        return apply_turn(tx, ops)
+
+class PendingTurn:
+    __slots__ = ('ops', 'result', 'error', 'done')
+
+    def __init__(self, ops):
+        self.ops = ops
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+class GroupCommitter:
+    def __init__(self, app, store, window, max_turns):
+        self.app = app
+        self.store = store
+        self.window = window
+        self.max_turns = max_turns
+        self.queue = queue.Queue()
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name='group-commit', daemon=True)
+        self.thread.start()
+        # batches committed and turns in them, for the log line on shutdown
+        self.batches = 0
+        self.turns = 0
+
+    def submit(self, ops):
+        # blocks until the batch with this turn has committed
+        pending = PendingTurn(ops)
+        self.queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def next_batch(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_turns:
+            try:
+                timeout = deadline - time.monotonic()
+                pending = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is None:
+                # stop once this batch is done
+                self.queue.put(None)
+                break
+            batch.append(pending)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            with self.app.app_context():
+                self.commit(batch)
+
+    def commit(self, batch):
+        try:
+            with self.store.transaction() as tx:
+                results = [apply_turn(tx, pending.ops) for pending in batch]
+        except Exception:
+            if len(batch) == 1:
+                self.app.logger.exception("Writing a turn failed")
+                batch[0].finish(error=RuntimeError("writing the turn failed"))
+                return
+            self.app.logger.warning("Group commit of %d turns failed, writing them one at a time", len(batch), exc_info=True)
+            for pending in batch:
+                self.commit([pending])
+            return
+        self.batches += 1
+        self.turns += len(batch)
+        for pending, result in zip(batch, results):
+            pending.finish(result)
+
+    def stop(self):
+        # turns already queued are still written
+        self.queue.put(None)
+        self.thread.join()
+
+class WriterService:
+    # `flask writer`: accepts connections from the workers, one thread per connection, and feeds
+    # their turns to a single GroupCommitter. answers are (new log rows or None, error message)
+    def __init__(self, committer, address, authkey):
+        self.committer = committer
+        self.address = address
+        self.authkey = authkey
+
+    def handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    ops = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send((self.committer.submit(ops), None))
+                except (EOFError, OSError):
+                    return
+                except Exception as e:
+                    conn.send((None, str(e)))
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            # left behind by a writer that didn't shut down cleanly
+            os.remove(self.address)
+        listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+
+        def stop(signum, frame):
+            raise KeyboardInterrupt
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError as e:
+                    # a client that failed the authkey challenge, or went away halfway through it
+                    self.committer.app.logger.warning("Rejected writer connection: %s", e)
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            self.committer.stop()
+
+class RemoteWriter:
+    # the worker side of `flask writer`, one connection per worker thread
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.local = threading.local()
+        self.pid = os.getpid()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            try:
+                conn = self.local.conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            except (OSError, EOFError) as e:
+                raise WriterUnavailable(str(e))
+        return conn
+
+    def submit(self, ops):
+        conn = self.connection()
+        try:
+            conn.send(ops)
+        except OSError:
+            # the writer restarted since this thread last used the connection, try a fresh one
+            conn.close()
+            self.local.conn = None
+            conn = self.connection()
+            try:
+                conn.send(ops)
+            except OSError as e:
+                self.local.conn = None
+                raise WriterUnavailable(str(e))
+        try:
+            result, error = conn.recv()
+        except (EOFError, OSError):
+            # the turn may or may not have been written, so it mustn't be written again
+            self.local.conn = None
+            raise RuntimeError("lost the connection to the writer before it answered")
+        if error is not None:
+            raise RuntimeError(f"writer failed: {error}")
+        return result
+
+def writer_authkey(config):
+    return config['SECRET_KEY'].encode('utf8')
+
+def create_committer(app, store):
+    config = app.config
+    return GroupCommitter(app, store, config.get('WRITE_BATCH_WINDOW_MS', 2) / 1000, config.get('WRITE_BATCH_MAX_TURNS', 64))
+
+writer_lock = threading.Lock()
+
+def get_writer():
+    config = current_app.config
+    mode = config.get('WRITE_MODE', 'direct')
+    if mode == 'direct':
+        return None
+    writer = current_app.extensions.get('turn_writer')
+    # the writer thread and the socket connections don't survive a fork
+    if writer is None or writer.pid != os.getpid():
+        # concurrent first requests must all end up with the same (single) writer
+        with writer_lock:
+            writer = current_app.extensions.get('turn_writer')
+            if writer is None or writer.pid != os.getpid():
+                if mode == 'local':
+                    writer = create_committer(current_app._get_current_object(), current_app.extensions['player_store'])
+                elif mode == 'service':
+                    writer = RemoteWriter(config['WRITER_ADDRESS'], writer_authkey(config))
+                else:
+                    raise ValueError(f"Unknown WRITE_MODE {mode!r}, expected direct, local or service")
+                current_app.extensions['turn_writer'] = writer
+    return writer
+
+@contextmanager
+def turn_transaction(store):
+    # used like store.transaction() for a turn. with a writer the block only records the turn,
+    # which is written (together with other turns) when the block exits
+    writer = get_writer()
+    if writer is None:
+        with store.transaction() as tx:
+            yield tx
+        return
+    recorder = TurnRecorder()
+    yield recorder
+    try:
+        result = writer.submit(recorder.ops)
+    except WriterUnavailable as e:
+        current_app.logger.warning("Writer unavailable (%s), writing the turn directly", e)
+        result = write_turn(store, recorder.ops)
+    if result is None:
+        raise StalePlayerState(None)
+    recorder.log_entries.extend(result)
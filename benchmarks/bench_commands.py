@@ -0,0 +1,248 @@
+# load test for the command loop: simulated players replay a scripted walkthrough against the
+# app through flask's test client (or a running server with --url) and the script reports
+# throughput, latency percentiles and sql statements per turn.
+#
+#   python benchmarks/bench_commands.py --players 8 --games 5
+#   python benchmarks/bench_commands.py --world synthetic --locations 1000 --players 16
+#   python benchmarks/bench_commands.py --url http://127.0.0.1:8000 --players 32
+#   python benchmarks/bench_commands.py --write-mode service --players 32
+#
+# every game is a fresh player (new session): GET / first, then one POST /api/command per
+# walkthrough command, with a GET / every --page-every commands like a player reloading the page.
+# the world is written to a snapshot in a temp directory (app/content for --world story, or
+# app/worldgen.py for --world synthetic) next to a fresh database, so runs are repeatable.
+
+import argparse
+import http.cookiejar
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# crates -> key -> door -> hallway -> dorms -> keycard -> main control room -> planet -> base camp
+STORY_WALKTHROUGH = [
+    "inspect switches",
+    "inspect crates",
+    "inventory",
+    "open door",
+    "open first door on the left",
+    "inspect desk",
+    "open door",
+    "open first door on the right",
+    "inspect bedside table",
+    "inspect desk",
+    "open door",
+    "open door at end of hallway",
+    "inspect windows",
+    "inspect control panel",
+    "open emergency exit",
+    "inspect trail",
+    "inspect trail to camp",
+    "inspect main tent",
+    "inventory",
+]
+
+class SqlCounter:
+    # counts the statements each thread runs on its sqlite connections (both pools)
+    def __init__(self):
+        self.local = threading.local()
+
+    def trace(self, statement):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def current(self):
+        return getattr(self.local, 'count', 0)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def prepare_world(args, snapshot):
+    from app.worldbuild import load_content, default_content_dir, validate_content, write_snapshot
+    from app.worldgen import generate_content, synthetic_walkthrough
+
+    if args.world == 'synthetic':
+        content = generate_content(args.locations, seed=args.seed)
+        walkthrough = synthetic_walkthrough(content)[:args.turns or None]
+    else:
+        content = load_content(default_content_dir())
+        walkthrough = STORY_WALKTHROUGH
+    errors, _ = validate_content(content)
+    if errors:
+        raise SystemExit("\n".join(errors))
+    version = write_snapshot(content, snapshot)
+    return version, walkthrough
+
+def create_test_app(counter):
+    from app import create_app
+    from app import db as app_db
+
+    connect = app_db.connect
+
+    def traced_connect(config, readonly=False):
+        db = connect(config, readonly)
+        db.set_trace_callback(counter.trace)
+        return db
+
+    app_db.connect = traced_connect
+    app = create_app()
+    with app.app_context():
+        app_db.prepare_database(app)
+    return app
+
+class TestClientPlayer:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def command(self, text):
+        response = self.client.post('/api/command', json={'command': text})
+        if response.status_code != 200:
+            raise RuntimeError(f"{text!r}: HTTP {response.status_code}")
+        return response.get_json()
+
+    def page(self):
+        response = self.client.get('/')
+        if response.status_code != 200:
+            raise RuntimeError(f"GET /: HTTP {response.status_code}")
+
+class HttpPlayer:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def command(self, text):
+        request = urllib.request.Request(self.url + '/api/command', data=json.dumps({'command': text}).encode('utf8'),
+                                         headers={'Content-Type': 'application/json'})
+        with self.opener.open(request) as response:
+            return json.load(response)
+
+    def page(self):
+        with self.opener.open(self.url + '/') as response:
+            response.read()
+
+def run_player(make_player, walkthrough, args, counter, results, lock):
+    commands, pages, statements = [], [], []
+    errors = 0
+    for _ in range(args.games):
+        player = make_player()
+        try:
+            started = time.perf_counter()
+            player.page()
+            pages.append(time.perf_counter() - started)
+            for i, text in enumerate(walkthrough, 1):
+                before = counter.current()
+                started = time.perf_counter()
+                player.command(text)
+                commands.append(time.perf_counter() - started)
+                statements.append(counter.current() - before)
+                if args.page_every and i % args.page_every == 0:
+                    started = time.perf_counter()
+                    player.page()
+                    pages.append(time.perf_counter() - started)
+        except Exception as e:
+            errors += 1
+            print(f"player error: {e}", file=sys.stderr)
+    with lock:
+        results['commands'].extend(commands)
+        results['pages'].extend(pages)
+        results['statements'].extend(statements)
+        results['errors'] += errors
+
+def report_latency(name, values):
+    if not values:
+        return
+    ms = [value * 1000 for value in values]
+    print(f"  {name:<10} n={len(ms):<7} mean={statistics.mean(ms):7.2f} ms  p50={percentile(ms, 0.5):7.2f}  "
+          f"p95={percentile(ms, 0.95):7.2f}  p99={percentile(ms, 0.99):7.2f}  max={max(ms):7.2f}")
+
+def start_writer(address):
+    # `flask writer` in its own process, against the same database as the test app
+    env = dict(os.environ, WRITER_ADDRESS=address)
+    process = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app:create_app', 'writer'], env=env,
+                               cwd=os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    deadline = time.monotonic() + 10
+    while not os.path.exists(address):
+        if process.poll() is not None or time.monotonic() > deadline:
+            raise SystemExit("flask writer did not start")
+        time.sleep(0.05)
+    return process
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=8, help='concurrent simulated players (threads)')
+    parser.add_argument('--games', type=int, default=3, help='walkthroughs per player, each one as a new player')
+    parser.add_argument('--page-every', type=int, default=5, help='GET / after this many commands (0 = never)')
+    parser.add_argument('--world', choices=('story', 'synthetic'), default='story')
+    parser.add_argument('--locations', type=int, default=200, help='rooms in the synthetic world')
+    parser.add_argument('--turns', type=int, default=100, help='cap on the synthetic walkthrough length (0 = whole world)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', default=None, help='drive a running server instead of the test client')
+    parser.add_argument('--write-mode', choices=('direct', 'local', 'service'), default='direct',
+                        help='WRITE_MODE for the test app (service starts a `flask writer` process)')
+    args = parser.parse_args()
+
+    counter = SqlCounter()
+    lock = threading.Lock()
+    results = {'commands': [], 'pages': [], 'statements': [], 'errors': 0}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # config.py reads these when app is first imported, so they have to be set before that
+        os.environ['DATABASE_URL'] = os.path.join(tmp, 'game.sqlite')
+        os.environ['WORLD_SNAPSHOT'] = os.path.join(tmp, 'world.sqlite')
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        os.environ['WRITE_MODE'] = args.write_mode
+        os.environ['WRITER_ADDRESS'] = os.path.join(tmp, 'writer.sock')
+        writer = None
+
+        version, walkthrough = prepare_world(args, os.environ['WORLD_SNAPSHOT'])
+        if args.url:
+            # the server has its own world, only the script comes from here
+            make_player = lambda: HttpPlayer(args.url)
+            print(f"target: {args.url}")
+        else:
+            app = create_test_app(counter)
+            make_player = lambda: TestClientPlayer(app)
+            if args.write_mode == 'service':
+                writer = start_writer(os.environ['WRITER_ADDRESS'])
+            print(f"world: {args.world} ({version}), database: {app.config['DATABASE']}, player store: {app.extensions['player_store'].name}, "
+                  f"writes: {args.write_mode}")
+
+        print(f"{args.players} players x {args.games} games x {len(walkthrough)} commands")
+        threads = [
+            threading.Thread(target=run_player, args=(make_player, walkthrough, args, counter, results, lock))
+            for _ in range(args.players)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if writer is not None:
+            writer.terminate()
+            writer.wait()
+        committer = None if args.url else app.extensions.get('turn_writer')
+        if args.write_mode == 'local' and committer is not None:
+            print(f"group commit: {committer.turns} turns in {committer.batches} batches")
+
+    requests = len(results['commands']) + len(results['pages'])
+    print(f"\n{len(results['commands'])} commands in {elapsed:.2f} s: {len(results['commands']) / elapsed:.1f} commands/s, "
+          f"{requests / elapsed:.1f} requests/s, {results['errors']} failed games")
+    report_latency('command', results['commands'])
+    report_latency('page', results['pages'])
+    if not args.url and results['statements']:
+        statements = results['statements']
+        print(f"  sql/turn   mean={statistics.mean(statements):.1f}  p50={percentile(statements, 0.5)}  max={max(statements)}"
+              f"  (sqlite only, includes BEGIN/COMMIT{', reads only: the turns are written by the writer' if args.write_mode != 'direct' else ''})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# compares query plans and latency of the per-player lookups before and after the schema
+# migrations (app/migrations.py) on a database seeded with lots of players.
+#
+#   python benchmarks/bench_indexes.py --players 100000
+#
+# the database is built in a temp directory from schema.sql (version 0), measured, migrated
+# in place with apply_migrations, and measured again.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.db import get_db
+from app.migrations import apply_migrations, get_schema_version
+from app.worldbuild import default_content_dir, insert_content, load_content
+from config import Config
+
+QUERIES = {
+    "story log (index)": "SELECT entry, category FROM story_log WHERE player_id = ? ORDER BY timestamp ASC",
+    "triggered flags (parse)": "SELECT story_flag_id FROM triggered_story_flags WHERE player_id = ?",
+    "flag check (parse)": "SELECT * FROM triggered_story_flags WHERE story_flag_id = 0 AND player_id = ?",
+    "inventory (parse)": "SELECT item_id FROM inventory WHERE player_id = ?",
+    "player row": "SELECT * FROM players WHERE player_id = ?",
+}
+
+LOG_ENTRIES = [
+    ("You find yourself in an abandoned control room", "Description"),
+    ("What would you like to do?", "Continue"),
+    ("Available objects are: crates, door, control panel, and switches", "Hint"),
+    ("", ""),
+    ("After more closely inspecting the crates, you notice that a smaller one on top of one of the stacks is slightly ajar.", ""),
+    ("+1: key", "Info"),
+    ("You force open a very heavy and secure metal door. ", ""),
+    ("Type 'inventory' to view full inventory. ", "Hint"),
+]
+
+def seed_players(db, players):
+    db.execute("BEGIN")
+    db.executemany("INSERT INTO players (player_id, current_location_id) VALUES (?, ?)",
+                   ((player_id, player_id % 11) for player_id in range(1, players + 1)))
+    db.executemany("INSERT INTO story_log (player_id, entry, category) VALUES (?, ?, ?)",
+                   ((player_id, entry, category) for player_id in range(1, players + 1) for entry, category in LOG_ENTRIES))
+    db.executemany("INSERT INTO triggered_story_flags (player_id, story_flag_id) VALUES (?, ?)",
+                   ((player_id, flag_id) for player_id in range(1, players + 1) for flag_id in range(player_id % 3)))
+    db.executemany("INSERT INTO inventory (player_id, item_id) VALUES (?, ?)",
+                   ((player_id, item_id) for player_id in range(1, players + 1) for item_id in range(player_id % 4)))
+    db.commit()
+
+def measure(db, players, samples):
+    rng = random.Random(1)
+    player_ids = [rng.randint(1, players) for _ in range(samples)]
+    results = {}
+    for name, sql in QUERIES.items():
+        plan = " / ".join(row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql, (1,)))
+        timings = []
+        for player_id in player_ids:
+            start = time.perf_counter()
+            db.execute(sql, (player_id,)).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = (plan, statistics.mean(timings), timings[int(len(timings) * 0.95) - 1])
+    return results
+
+def report(label, results):
+    print(f"\n== {label} ==")
+    for name, (plan, mean_ms, p95_ms) in results.items():
+        print(f"{name:<26} mean {mean_ms:8.3f} ms   p95 {p95_ms:8.3f} ms   plan: {plan}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=100_000)
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        class BenchConfig(Config):
+            DATABASE = os.path.join(tmp, 'bench.sqlite')
+
+        app = create_app(BenchConfig)
+        with app.app_context():
+            db = get_db()
+            with app.open_resource('schema.sql') as f:
+                db.executescript(f.read().decode('utf8'))
+            # straight into the version 0 tables, populate_db needs world_meta from migration 4
+            db.execute("BEGIN")
+            insert_content(db, load_content(default_content_dir()))
+            db.commit()
+
+            print(f"Seeding {args.players} players...")
+            start = time.perf_counter()
+            seed_players(db, args.players)
+            print(f"Seeded in {time.perf_counter() - start:.1f}s (schema version {get_schema_version(db)})")
+
+            before = measure(db, args.players, args.samples)
+
+            start = time.perf_counter()
+            applied = apply_migrations(db)
+            print(f"Applied migrations {applied} in {time.perf_counter() - start:.1f}s")
+            db.execute("ANALYZE")
+
+            after = measure(db, args.players, args.samples)
+
+        report("before migrations", before)
+        report("after migrations", after)
+        print("\nspeedup (mean):")
+        for name in QUERIES:
+            print(f"{name:<26} {before[name][1] / max(after[name][1], 1e-9):8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+from app.game.graph import WorldGraph
+from app.game.rules import has_item
+
+def build_world(rooms, links, interactions):
+    # links: {link_id: (from, to)}, interactions: (room, link_id or None, requires_item_id, gives_item_id)
+    objects = {}
+    rows = {}
+    for interaction_id, (room, link_id, requires_item_id, gives_item_id) in enumerate(interactions):
+        objects[interaction_id] = SimpleNamespace(object_id=interaction_id, location_id=room)
+        rows[interaction_id] = SimpleNamespace(
+            object_id=interaction_id, action='open', location_link_id=link_id,
+            requires_item_id=requires_item_id, requires_story_flag_id=None,
+            gives_item_id=gives_item_id, activates_story_flag_id=None,
+        )
+    return SimpleNamespace(
+        locations=dict.fromkeys(rooms),
+        objects=objects,
+        interactions=rows,
+        location_links={link_id: SimpleNamespace(location_link_id=link_id, to_location_id=to) for link_id, (_, to) in links.items()},
+        items={}, story_flags={},
+    )
+
+def test_soft_lock_when_the_way_back_needs_the_skipped_key():
+    # room 0 has the key and a free one-way hatch to 1, the door from 1 to 2 needs the key and 2
+    # leads back to 0. taking the hatch without the key strands the player in 1
+    world = build_world([0, 1, 2], {0: (0, 1), 1: (1, 2), 2: (2, 0)}, [
+        (0, None, None, 7),
+        (0, 0, None, None),
+        (1, 1, 7, None),
+        (2, 2, None, None),
+    ])
+    locks = WorldGraph(world).report(0)['soft_locks']
+    assert [(edge.from_location_id, edge.to_location_id, key) for edge, key in locks] == [(0, 1, has_item(7))]
+
+def test_no_soft_lock_when_the_key_is_on_the_way():
+    # same rooms, but the key is in room 1 behind the hatch
+    world = build_world([0, 1, 2], {0: (0, 1), 1: (1, 2), 2: (2, 0)}, [
+        (1, None, None, 7),
+        (0, 0, None, None),
+        (1, 1, 7, None),
+        (2, 2, None, None),
+    ])
+    assert WorldGraph(world).report(0)['soft_locks'] == []